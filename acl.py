@@ -0,0 +1,89 @@
+from collections import Counter
+import logging
+import os
+import threading
+import time
+
+###
+# Access control. The file "allowed_users" has one user per line: a user_id,
+# optionally followed by the only commands that user may run, e.g.
+#
+#     123456789
+#     987654321 ping read ls
+#
+# The file is read again whenever it changes, at most once every CHECK_INTERVAL
+# seconds. Lines starting with '#' are comments; other lines that aren't a
+# user_id are logged and skipped. Rejected updates are counted per user and
+# command.
+###
+
+USERS = "allowed_users"
+CHECK_INTERVAL = 1.0
+
+# Kept across reloads (see reloader.py).
+try:
+    users
+except NameError:
+    # users = {user_id: frozenset of commands, or None for every command}
+    users = {}
+    mtime = None
+    checked = 0
+    lock = threading.Lock()
+
+    rejected = Counter()
+
+logger = logging.getLogger(__name__)
+
+def parse(f):
+    parsed = {}
+    for number, l in enumerate(f, 1):
+        fields = l.split()
+        if not fields or fields[0].startswith('#'):
+            continue
+        try:
+            user_id = int(fields[0])
+        except ValueError:
+            logger.warning("Skipping line %d of %s: %r.", number, USERS, l)
+            continue
+        commands = frozenset(c.lstrip('/') for c in fields[1:])
+        parsed[user_id] = commands or None
+    return parsed
+
+def refresh():
+    global users, mtime, checked
+    now = time.monotonic()
+    if now - checked < CHECK_INTERVAL:
+        return
+    with lock:
+        checked = now
+        try:
+            current = os.stat(USERS).st_mtime_ns
+        except FileNotFoundError:
+            users = {}
+            mtime = None
+            return
+        if current == mtime:
+            return
+        with open(USERS, 'r') as f:
+            users = parse(f)
+        mtime = current
+
+# command is None for updates that aren't commands (text, buttons).
+def allowed(user_id, command):
+    refresh()
+    commands = users.get(user_id, False)
+    if commands is False:
+        return False
+    return commands is None or command is None or command in commands
+
+def reject(user_id, command):
+    rejected[(user_id, command)] += 1
+
+# The command of an update, without the slash and the bot's name.
+def command_of(update):
+    message = update.effective_message
+    if update.callback_query is not None or message is None or not message.text:
+        return None
+    if not message.text.startswith('/'):
+        return None
+    return message.text.split()[0][1:].split('@')[0]
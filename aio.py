@@ -0,0 +1,129 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+
+from telegram.ext import DispatcherHandlerStop
+
+import settings
+
+###
+# Asyncio dispatch. The dispatcher thread only hands updates over to an event
+# loop and goes back for the next one. Handlers (file and git work included)
+# run on an executor; the updates of one user run in order, different users
+# run in parallel. Messages sent by a handler don't block it: each send is a
+# task of its own, ordered per chat, and the update finishes once they're all
+# done.
+###
+
+logger = logging.getLogger(__name__)
+
+loop = None
+executor = None
+# The last task of each user and of each chat. New tasks wait for them.
+user_tails = {}
+chat_tails = {}
+
+def start():
+    global loop, executor
+    if loop is not None:
+        return
+    executor = ThreadPoolExecutor(settings.ASYNC_WORKERS,
+        thread_name_prefix="handler")
+    loop = asyncio.new_event_loop()
+    loop.set_default_executor(executor)
+    threading.Thread(target=loop.run_forever, name="aio", daemon=True).start()
+
+# Wraps the callbacks of every handler registered on the dispatcher. Groups
+# below 0 are middleware that must be able to stop an update, so they stay on
+# the dispatcher thread.
+def wrap_handlers(dispatcher):
+    start()
+    for group, handlers in dispatcher.handlers.items():
+        if group < 0:
+            continue
+        for handler in handlers:
+            handler.callback = wrap(handler.callback)
+
+# The context is wrapped right away, on the dispatcher thread: PTB uses one
+# context for every group of an update, and the handlers of the next groups
+# set their own arguments on it before this callback runs.
+def wrap(callback):
+    def schedule(update, context):
+        asyncio.run_coroutine_threadsafe(
+            enqueue(callback, update, AsyncContext(context)), loop)
+    return schedule
+
+# Runs on the loop, so the tails need no lock.
+async def enqueue(callback, update, context):
+    user_id = update.effective_user.id if update.effective_user else None
+    previous = user_tails.get(user_id)
+    task = asyncio.ensure_future(run(previous, callback, update, context))
+    user_tails[user_id] = task
+    task.add_done_callback(lambda t: forget(user_tails, user_id, t))
+
+def forget(tails, key, task):
+    if tails.get(key) is task:
+        del tails[key]
+
+async def run(previous, callback, update, context):
+    if previous is not None:
+        await asyncio.wait([previous])
+
+    try:
+        await loop.run_in_executor(None, callback, update, context)
+    except DispatcherHandlerStop:
+        pass
+    except Exception as e:
+        await loop.run_in_executor(None, context.dispatcher.dispatch_error,
+            update, e)
+    if context.bot.sends:
+        await asyncio.wait([asyncio.wrap_future(f) for f in context.bot.sends])
+
+###
+# Handlers get a context whose bot sends in the background.
+###
+
+# Keeps its own copy of what each handler sets on the context: the arguments
+# of commands, the matches of patterns and the plugin (see plugins.py).
+class AsyncContext:
+    def __init__(self, context):
+        self._context = context
+        self.bot = AsyncBot(context.bot)
+        self.args = context.args
+        self.matches = context.matches
+        self.plugin = getattr(context, "plugin", None)
+
+    def __getattr__(self, name):
+        return getattr(self._context, name)
+
+class AsyncBot:
+    def __init__(self, bot):
+        self._bot = bot
+        self.sends = []
+
+    def __getattr__(self, name):
+        return getattr(self._bot, name)
+
+    # Called from the executor. Returns the concurrent future of the send.
+    def send_message(self, chat_id, text, **kwargs):
+        future = asyncio.run_coroutine_threadsafe(
+            send(self._bot, chat_id, text, kwargs), loop)
+        self.sends.append(future)
+        return future
+
+async def send(bot, chat_id, text, kwargs):
+    previous = chat_tails.get(chat_id)
+    task = asyncio.ensure_future(send_after(previous, bot, chat_id, text, kwargs))
+    chat_tails[chat_id] = task
+    task.add_done_callback(lambda t: forget(chat_tails, chat_id, t))
+    return await task
+
+async def send_after(previous, bot, chat_id, text, kwargs):
+    if previous is not None:
+        await asyncio.wait([previous])
+    try:
+        return await loop.run_in_executor(None,
+            lambda: bot.send_message(chat_id=chat_id, text=text, **kwargs))
+    except Exception:
+        logger.exception("Couldn't send message to %s.", chat_id)
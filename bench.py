@@ -0,0 +1,644 @@
+#-------------#
+# Benchmarks. #
+#-------------#
+
+# Run with: python bench.py [benchmark[:argument] ...]
+# They run without a token or network. Most only need the standard library
+# (and coreutils for the old sed paths); dispatch, webhook, replay and
+# documents also need python-telegram-bot.
+
+import os
+import subprocess as subproc
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+import committer
+import editor
+import history
+import journal
+import lineindex
+import listing
+from registers import Register
+import search
+import settings
+import utils
+
+def timeit(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+def report(name, seconds):
+    print("{:<40} {:>10.3f} ms".format(name, seconds * 1000))
+
+def make_file(directory, lines):
+    filename = os.path.join(directory, "file.txt")
+    with open(filename, 'w') as f:
+        for i in range(lines):
+            f.write("line number {} of the benchmark file\n".format(i))
+    return filename
+
+###
+# Line editor against the old sed/wc chain.
+###
+
+# The way bot.py used to inject a register: count the lines with wc, then sed
+# with a trailing newline fix before and after the edit.
+def sed_inject(filename, line, text):
+    wc = subproc.check_output(["wc", "-l", filename], encoding="UTF-8")
+    if line > int(wc.split(' ')[0]):
+        return
+    subproc.run(["sed", "-i", "-e", "$ a \\", filename], check=True)
+    subproc.run(["sed", "-i", "{} i {}".format(line, repr(text)[1:-1]),
+        filename], check=True)
+    subproc.run(["sed", "-i", "-e", "$ a \\", filename], check=True)
+
+def sed_trim(filename, line_start, line_end):
+    subproc.run(["sed", "-i", "-e", "$ a \\", filename], check=True)
+    subproc.run(["sed", "-i", "{},{}d".format(line_start, line_end),
+        filename], check=True)
+    subproc.run(["sed", "-i", "-e", "$ a \\", filename], check=True)
+
+def bench_editor():
+    text = "def f():\n    return 1"
+    for size in [100, 10000, 200000]:
+        with tempfile.TemporaryDirectory() as directory:
+            filename = make_file(directory, size)
+            repeat = 20 if size < 200000 else 5
+            report("sed inject ({} lines)".format(size),
+                timeit(lambda: sed_inject(filename, size // 2, text), repeat))
+            report("editor inject ({} lines)".format(size),
+                timeit(lambda: editor.insert(filename, size // 2, text), repeat))
+            report("sed trim ({} lines)".format(size),
+                timeit(lambda: sed_trim(filename, size // 2, size // 2 + 1),
+                    repeat))
+            report("editor trim ({} lines)".format(size),
+                timeit(lambda: editor.delete(filename, size // 2, size // 2 + 1),
+                    repeat))
+
+###
+# Register journal against re-pickling the whole rom.
+###
+
+def make_rom(users, registers, size):
+    rom = {}
+    for user_id in range(users):
+        rom[user_id] = [None, {}]
+        for i in range(registers):
+            rom[user_id][1]["r{}".format(i)] = Register('x' * size)
+    return rom
+
+def bench_journal():
+    cwd = os.getcwd()
+    for users in [1, 100, 1000]:
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                rom = make_rom(users, 10, 1000)
+                report("save_rom ({} users)".format(users),
+                    timeit(lambda: utils.save_rom(rom), 10))
+
+                # No compaction during the measurement.
+                settings.JOURNAL_COMPACT_RECORDS = 10 ** 9
+                rom = journal.load()
+                rom.update(make_rom(users, 10, 1000))
+                report("journal set_register ({} users)".format(users),
+                    timeit(lambda: journal.set_register(rom, 0, "r0"), 100))
+                journal.journal.close()
+            finally:
+                os.chdir(cwd)
+
+###
+# Register buffers against string concatenation.
+###
+
+# Like register_insert used to, through the registry dict. That defeats
+# CPython's in-place concatenation of local strings.
+def concatenate(messages):
+    registers = {"r": ""}
+    for m in messages:
+        if registers["r"]:
+            registers["r"] += '\n'
+        registers["r"] += m
+    return registers["r"]
+
+def chunked(messages):
+    register = Register()
+    for m in messages:
+        register.append(m)
+    return register.text()
+
+def bench_registers():
+    for count in [100, 1000, 10000]:
+        # Pasting a file as messages of up to 4096 characters.
+        messages = ['x' * 4000] * count
+        report("concatenation ({} messages)".format(count),
+            timeit(lambda: concatenate(messages), 3))
+        report("register ({} messages)".format(count),
+            timeit(lambda: chunked(messages), 3))
+
+###
+# Asyncio dispatch against running every handler on the dispatcher thread.
+###
+
+# Stands in for the Telegram API: every call takes as long as a round-trip.
+class FakeBot:
+    def __init__(self, latency):
+        self.latency = latency
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def send_message(self, chat_id, text, **kwargs):
+        time.sleep(self.latency)
+        with self.lock:
+            self.sent.append((chat_id, text))
+
+class FakeDispatcher:
+    def dispatch_error(self, update, error):
+        raise error
+
+def fake_update(user_id, text):
+    user = SimpleNamespace(id=user_id)
+    return SimpleNamespace(effective_user=user, effective_chat=user,
+        message=SimpleNamespace(text=text))
+
+# A handler that does some file work and answers.
+def fake_handler(update, context):
+    time.sleep(0.005)
+    context.bot.send_message(chat_id=update.effective_chat.id,
+        text=update.message.text)
+
+def bench_dispatch():
+    import aio
+
+    users = 20
+    per_user = 20
+    updates = [fake_update(u, str(i))
+        for i in range(per_user) for u in range(users)]
+
+    bot = FakeBot(0.02)
+    context = SimpleNamespace(bot=bot, dispatcher=FakeDispatcher(), args=[])
+    start = time.perf_counter()
+    for update in updates:
+        fake_handler(update, context)
+    report("sync ({} updates)".format(len(updates)),
+        time.perf_counter() - start)
+
+    settings.ASYNC_WORKERS = 32
+    aio.start()
+    bot = FakeBot(0.02)
+    context = SimpleNamespace(bot=bot, dispatcher=FakeDispatcher(), args=[])
+    handler = aio.wrap(fake_handler)
+    start = time.perf_counter()
+    for update in updates:
+        handler(update, context)
+    while len(bot.sent) < len(updates):
+        time.sleep(0.001)
+    report("asyncio ({} updates)".format(len(updates)),
+        time.perf_counter() - start)
+
+    # Every user's replies must come back in order.
+    for u in range(users):
+        texts = [t for chat_id, t in bot.sent if chat_id == u]
+        assert texts == [str(i) for i in range(per_user)], texts
+
+###
+# Indexed reads against sed -n.
+###
+
+def bench_read():
+    with tempfile.TemporaryDirectory() as directory:
+        filename = make_file(directory, 2000000)
+        # Builds the index.
+        lineindex.read_lines(filename, 1, 1)
+        for line in [1, 100000, 1900000]:
+            report("sed -n (line {})".format(line),
+                timeit(lambda: subproc.check_output(["sed", "-n",
+                    "{},{}p".format(line, line + 5), filename]), 5))
+            report("line index (line {})".format(line),
+                timeit(lambda: lineindex.read_lines(filename, line, line + 5),
+                    100))
+
+        with open(filename, 'a') as f:
+            f.write("appended\n")
+        report("line index after append",
+            timeit(lambda: lineindex.read_lines(filename, 2000001, 2000001), 1))
+
+###
+# Cached scandir listing against ls.
+###
+
+def bench_ls():
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(20000):
+            open(os.path.join(directory, "file{}".format(i)), 'w').close()
+        report("ls (20000 entries)",
+            timeit(lambda: subproc.check_output(["ls", directory]), 5))
+        report("scandir (20000 entries)",
+            timeit(lambda: listing.scan(directory), 5))
+        report("cached (20000 entries)",
+            timeit(lambda: listing.list_directory(directory), 100))
+
+###
+# /log and /revert on a repository with thousands of bot commits.
+###
+
+# Builds the history with fast-import, one edit of one of 20 files per commit.
+def make_repository(directory, count):
+    subproc.run(["git", "init", "-q", directory], check=True)
+    stream = []
+    for i in range(count):
+        content = "version {}\n".format(i).encode()
+        message = "Injected contents of register r into line 1 of file f{}.".format(i % 20).encode()
+        stream.append(b"commit refs/heads/master\n")
+        stream.append(b"committer bot <bot@localhost> %d +0000\n" % (1600000000 + i))
+        stream.append(b"data %d\n%s\n" % (len(message), message))
+        stream.append(b"M 644 inline f%d\ndata %d\n%s\n" % (i % 20, len(content), content))
+    subproc.run(["git", "fast-import", "--quiet"], input=b"".join(stream),
+        cwd=directory, check=True)
+    subproc.run(["git", "checkout", "-q", "-f", "master"], cwd=directory,
+        check=True)
+    subproc.run(["git", "config", "user.name", "bot"], cwd=directory, check=True)
+    subproc.run(["git", "config", "user.email", "bot@localhost"], cwd=directory,
+        check=True)
+
+def bench_history():
+    with tempfile.TemporaryDirectory() as directory:
+        make_repository(directory, 5000)
+        committer.REPO = directory
+
+        report("full git log (5000 commits)",
+            timeit(lambda: history.log("-n", "5000"), 3))
+        start = time.perf_counter()
+        history.refresh()
+        report("index build", time.perf_counter() - start)
+        report("/log, unchanged history",
+            timeit(lambda: history.recent(10), 100))
+        report("/log f3, unchanged history",
+            timeit(lambda: history.recent(10, os.path.join(directory, "f3")),
+                100))
+
+        def revert():
+            commit = history.recent(50)[-1]
+            history.revert(commit, os.path.join(directory, "f3"))
+            committer.flush()
+        report("/revert f3 (index update included)", timeit(revert, 10))
+
+###
+# Webhook throughput, posting updates to the local endpoint.
+###
+
+def synthetic_updates(count):
+    for i in range(count):
+        user = {"id": 1000 + i % 10, "is_bot": False, "first_name": "user"}
+        yield {"update_id": i, "message": {"message_id": i, "date": 0,
+            "chat": {"id": user["id"], "type": "private"}, "from": user,
+            "text": "/ping"}}
+
+# Posts updates (recorded ones, one JSON object per line, if a file is given)
+# from several connections at once.
+def bench_webhook(recorded=None):
+    import http.client
+    import json
+    from telegram import Bot
+    from telegram.ext import Dispatcher, TypeHandler
+    import webhook
+
+    if recorded:
+        with open(recorded, 'r') as f:
+            updates = [json.loads(l) for l in f if l.strip()]
+    else:
+        updates = list(synthetic_updates(5000))
+
+    handled = []
+    dispatcher = Dispatcher(Bot("123:offline"), None)
+    dispatcher.add_handler(TypeHandler(object, lambda u, c: handled.append(u)))
+    server = webhook.start(dispatcher, address=("127.0.0.1", 0),
+        secret="bench", size=1000)
+    port = server.server_address[1]
+
+    def post(chunk):
+        connection = http.client.HTTPConnection("127.0.0.1", port)
+        for update in chunk:
+            while True:
+                connection.request("POST", "/", json.dumps(update),
+                    {"X-Telegram-Bot-Api-Secret-Token": "bench",
+                    "Content-Type": "application/json"})
+                response = connection.getresponse()
+                response.read()
+                if response.status != 503:
+                    break
+                time.sleep(0.01)
+        connection.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=post, args=(updates[i::8],))
+        for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    while len(handled) < len(updates):
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    report("webhook ({} updates)".format(len(updates)), elapsed)
+    print("{:.0f} updates/s, {} answered 503".format(len(updates) / elapsed,
+        server.rejected))
+    server.shutdown()
+
+###
+# Register memory and disk footprint, with and without the blob store.
+###
+
+def bench_blobs():
+    import pickle
+    import tracemalloc
+
+    users = 200
+    # Every user keeps a few versions of the same large files.
+    versions = ["".join("line {} of version {}\n".format(i, v)
+        for i in range(2000)) for v in range(5)]
+
+    def build(freeze):
+        rom = {}
+        for user_id in range(users):
+            rom[user_id] = [None, {}]
+            for v, text in enumerate(versions):
+                # A fresh string for every register, as if pasted again.
+                register = Register(text[:-1] + text[-1])
+                if freeze:
+                    register.freeze()
+                rom[user_id][1]["v{}".format(v)] = register
+        return rom
+
+    for freeze in [False, True]:
+        name = "blob store" if freeze else "plain registers"
+        tracemalloc.start()
+        rom = build(freeze)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        disk = len(pickle.dumps(journal.snapshot_of(rom),
+            pickle.HIGHEST_PROTOCOL))
+        print("{:<40} {:>8.1f} MB memory {:>8.1f} MB rom.pickle".format(
+            "{} ({} users)".format(name, users), memory / 2 ** 20,
+            disk / 2 ** 20))
+
+###
+# /grep and /sub against sed.
+###
+
+def bench_grep():
+    with tempfile.TemporaryDirectory() as directory:
+        filename = make_file(directory, 2000000)
+        for pattern in ["number 1999999 ", "number 1[0-9]{3} "]:
+            report("sed -n = ({})".format(pattern),
+                timeit(lambda: subproc.check_output(["sed", "-n", "-E",
+                    "/{}/{{=;p}}".format(pattern), filename]), 3))
+            report("mmap search ({})".format(pattern),
+                timeit(lambda: list(search.grep(pattern, [filename])), 3))
+        report("mmap search, cached pattern",
+            timeit(lambda: list(search.grep("number 1999999 ", [filename])),
+                3))
+
+        report("sed -i s///",
+            timeit(lambda: subproc.run(["sed", "-i", "-E",
+                "s/number (1999998) /number \\1 /", filename], check=True), 3))
+        report("substitute and apply",
+            timeit(lambda: search.apply(search.substitute(
+                "number (1999998) ", "number \\1 ", filename)), 3))
+
+###
+# An editing session on one file, with and without the buffer cache.
+###
+
+def bench_buffers():
+    text = "def f():\n    return 1"
+    cap = settings.BUFFER_CACHE_BYTES
+    for size in [10000, 200000]:
+        for name, limit in [("uncached", 0), ("cached", cap)]:
+            settings.BUFFER_CACHE_BYTES = limit
+            with tempfile.TemporaryDirectory() as directory:
+                filename = make_file(directory, size)
+
+                def session():
+                    editor.insert(filename, size // 2, text)
+                    editor.replace(filename, size // 2, size // 2 + 1, text)
+                    editor.delete(filename, size // 2, size // 2 + 1)
+                report("{} read ({} lines)".format(name, size),
+                    timeit(lambda: editor.read_lines(filename), 20))
+                report("{} 3 edits ({} lines)".format(name, size),
+                    timeit(session, 5))
+    settings.BUFFER_CACHE_BYTES = cap
+    print("hits {}, misses {}".format(editor.cache_hits, editor.cache_misses))
+
+###
+# Syntax checks of Python edits: a full compile against the piecewise check.
+###
+
+def bench_syntax():
+    import syntax
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    lines = editor.read_lines(os.path.join(here, "handlers.py")) * 10
+    line = lines.index("def ping(update, context):") + 2
+    report("compile ({} lines)".format(len(lines)),
+        timeit(lambda: compile('\n'.join(lines), "handlers.py", "exec"), 5))
+    syntax.check("handlers.py", lines)
+    count = iter(range(1000000))
+    report("check after a one line edit",
+        timeit(lambda: syntax.check("handlers.py", editor.insert_into_buffer(
+            lines, line, "    x = {}".format(next(count)))), 20))
+
+###
+# Replayed sessions against the stand-in Bot API (see fakeapi.py). The bot runs
+# in a process of its own, on a copy of the code in a temporary repository, so
+# its edits and commits don't touch this one.
+###
+
+# A session of one user: a register filled message by message, written to a
+# file and edited, the file read a page at a time, and a /ping to tell when
+# it's over. The first user also restarts the bot halfway.
+def replay_session(user, messages):
+    filename = "replay{}.txt".format(user)
+    texts = ["/in r"]
+    texts += ["line {} of the register of user {}".format(i, user)
+        for i in range(messages)]
+    texts += ["/ni", "/new r " + filename, "/in s"]
+    texts += ["inserted line {}".format(i) for i in range(20)]
+    texts += ["/ni", "/inject s {} {}".format(filename, messages // 3)]
+    if user == 0:
+        texts.append("/restart")
+    texts += ["/read {} {} {}".format(filename, line, line + 19)
+        for line in range(1, messages + 20, 20)]
+    texts += ["/trim {} 10 30".format(filename), "/ping"]
+    return texts
+
+# Runs in the bot's process, started by replay.
+def replay_child(base_url, base_file_url):
+    import json
+    import resource
+    import bot
+    import outbox
+    import stats
+
+    # The stand-in has no flood limits, and it's the bot being measured.
+    settings.SEND_RATE = settings.SEND_CHAT_RATE = 100000.0
+    updater = bot.create("123:replay", base_url, base_file_url)
+    updater.start_polling(poll_interval=0, timeout=1)
+    sys.stdin.readline()
+    outbox.flush(10)
+    committer.flush()
+    updater.stop()
+    json.dump({"stats": stats.snapshot(),
+        "rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}, sys.stdout)
+
+# True once every user got their "Pong.". Replies may be merged by the outbox,
+# so the pongs are counted by line.
+def pongs(users):
+    return lambda calls: sum(p.get("text", "").split('\n').count("Pong.")
+        for _, m, p in calls if m == "sendMessage") >= users
+
+# Starts the bot against server, hands it updates from users 1000 onwards and
+# waits until done(calls). Returns (seconds taken, whether done, the bot's
+# stats and peak RSS).
+def replay(server, updates, users, done, timeout=600):
+    import json
+    import shutil
+
+    with tempfile.TemporaryDirectory() as directory:
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in os.listdir(here):
+            if name.endswith(".py"):
+                shutil.copy(os.path.join(here, name), directory)
+        with open(os.path.join(directory, "allowed_users"), 'w') as f:
+            f.write("".join("{}\n".format(1000 + u) for u in range(users)))
+        subproc.run(["git", "init", "-q", directory], check=True)
+        for key, value in [("user.name", "bench"), ("user.email", "bench@localhost")]:
+            subproc.run(["git", "-C", directory, "config", key, value],
+                check=True)
+
+        child = subproc.Popen([sys.executable, "bench.py", "--replay-child",
+            server.base_url, server.base_file_url], cwd=directory,
+            stdin=subproc.PIPE, stdout=subproc.PIPE, encoding="UTF-8")
+        # The bot is up once it asks for updates.
+        server.wait(lambda calls: any(m == "getUpdates" for _, m, _ in calls),
+            60)
+
+        start = time.perf_counter()
+        server.script(updates)
+        finished = server.wait(done, timeout)
+        elapsed = time.perf_counter() - start
+
+        child.stdin.write("stop\n")
+        child.stdin.flush()
+        result = json.loads(child.stdout.read())
+        child.wait()
+
+    if not finished:
+        print("Timed out, not every session finished.")
+    return elapsed, finished, result
+
+def bench_replay(users="4", messages="300"):
+    import fakeapi
+
+    users = int(users)
+    messages = int(messages)
+    sessions = [replay_session(u, messages) for u in range(users)]
+    # The users take turns, one update each.
+    texts = [(u, s[i]) for i in range(max(len(s) for s in sessions))
+        for u, s in enumerate(sessions) if i < len(s)]
+    updates = [fakeapi.message_update(i + 1, 1000 + u, text)
+        for i, (u, text) in enumerate(texts)]
+
+    server = fakeapi.start()
+    elapsed, _, result = replay(server, updates, users, pongs(users))
+    server.close()
+
+    print("{:<40} {:>10.0f} updates/s".format(
+        "{} users, {} updates".format(users, len(updates)),
+        len(updates) / elapsed))
+    report("total", elapsed)
+    for name, count, _, quantiles in result["stats"]:
+        if name.startswith("command") or name.startswith("handler"):
+            print("{:<40} {:>6} calls p50 {:>8.2f} ms p95 {:>8.2f} ms".format(
+                name, count, quantiles[0] * 1000, quantiles[1] * 1000))
+    # ru_maxrss is in kilobytes on Linux.
+    print("{:<40} {:>10.1f} MB".format("peak RSS", result["rss"] / 1024))
+
+# A file of lines sent into a register as one document and as messages, and
+# sent back with /get and with /read.
+def bench_documents(lines="20000"):
+    import fakeapi
+
+    lines = int(lines)
+    texts = ["line {} of the document".format(i) for i in range(lines)]
+    content = "".join(t + '\n' for t in texts).encode("UTF-8")
+    # Messages of up to 4096 characters, the most Telegram takes.
+    messages = []
+    for text in texts:
+        if messages and len(messages[-1]) + len(text) < 4096:
+            messages[-1] += '\n' + text
+        else:
+            messages.append(text)
+
+    server = fakeapi.start()
+    file_id = server.add_file(content)
+    sessions = {
+        "document": [("document", file_id)],
+        "{} messages".format(len(messages)): messages,
+    }
+    for name, session in sessions.items():
+        updates = []
+        for text in ["/in d"] + session + ["/ni", "/new d d.txt", "/get d.txt",
+                "/ping"]:
+            if text[0] == "document":
+                updates.append(fakeapi.document_update(len(updates) + 1, 1000,
+                    text[1], len(content)))
+            else:
+                updates.append(fakeapi.message_update(len(updates) + 1, 1000,
+                    text))
+        with server.condition:
+            server.calls.clear()
+        elapsed, _, result = replay(server, updates, 1, pongs(1))
+        report("register from {} ({} B)".format(name, len(content)), elapsed)
+        for stat, count, total, _ in result["stats"]:
+            if stat.startswith("document"):
+                print("{:<40} {:>10.1f} MB/s".format(stat,
+                    len(content) / total / 2 ** 20))
+    server.close()
+
+BENCHMARKS = {
+    "editor": bench_editor,
+    "journal": bench_journal,
+    "registers": bench_registers,
+    "dispatch": bench_dispatch,
+    "read": bench_read,
+    "ls": bench_ls,
+    "history": bench_history,
+    "webhook": bench_webhook,
+    "blobs": bench_blobs,
+    "grep": bench_grep,
+    "buffers": bench_buffers,
+    "syntax": bench_syntax,
+    "replay": bench_replay,
+    "documents": bench_documents,
+}
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--replay-child"]:
+        replay_child(sys.argv[2], sys.argv[3])
+        sys.exit()
+
+    # A benchmark can take an argument: webhook:updates.jsonl
+    names = sys.argv[1:] or list(BENCHMARKS.keys())
+    for name in names:
+        name, _, argument = name.partition(':')
+        print("# {}".format(name))
+        if argument:
+            BENCHMARKS[name](argument)
+        else:
+            BENCHMARKS[name]()
@@ -0,0 +1,75 @@
+import hashlib
+import threading
+import zlib
+
+import settings
+
+###
+# Blob store. Released registers are stored by the hash of their content, so
+# identical registers (of one user or several) share a single copy. Contents
+# bigger than settings.BLOB_COMPRESS_THRESHOLD are kept compressed when that
+# saves space. Blobs are counted by reference and dropped with the last one.
+###
+
+class Blob:
+    def __init__(self, data, compressed, size):
+        self.data = data
+        self.compressed = compressed
+        # Bytes of the content, uncompressed.
+        self.size = size
+        self.refs = 1
+
+# blobs = {digest: Blob}
+blobs = {}
+lock = threading.Lock()
+
+# Stores text (or takes one more reference to it) and returns its digest.
+def intern(text):
+    data = text.encode("UTF-8")
+    size = len(data)
+    digest = hashlib.sha256(data).hexdigest()
+    with lock:
+        blob = blobs.get(digest)
+        if blob is not None:
+            blob.refs += 1
+            return digest
+
+    compressed = False
+    if len(data) > settings.BLOB_COMPRESS_THRESHOLD:
+        packed = zlib.compress(data, 6)
+        if len(packed) < len(data):
+            data = packed
+            compressed = True
+
+    with lock:
+        blob = blobs.get(digest)
+        if blob is not None:
+            # Stored by another thread meanwhile.
+            blob.refs += 1
+        else:
+            blobs[digest] = Blob(data, compressed, size)
+    return digest
+
+def get(digest):
+    blob = blobs[digest]
+    data = blob.data
+    if blob.compressed:
+        data = zlib.decompress(data)
+    return data.decode("UTF-8")
+
+def release(digest):
+    with lock:
+        blob = blobs[digest]
+        blob.refs -= 1
+        if blob.refs == 0:
+            del blobs[digest]
+
+def size(digest):
+    return blobs[digest].size
+
+# Bytes held in memory for the blob, whoever shares it.
+def stored_size(digest):
+    return len(blobs[digest].data)
+
+def shared(digest):
+    return blobs[digest].refs > 1
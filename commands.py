@@ -0,0 +1,99 @@
+from collections import namedtuple
+import functools
+
+###
+# Command registry. Every command is declared once, with its arguments and its
+# help text; the CommandHandlers, the /help message and the parsing of
+# context.args are all built from those declarations.
+###
+
+# Marks an argument without a default.
+REQUIRED = object()
+
+# type converts the argument's text, raising ValueError if it's invalid. A
+# callable default gets the arguments parsed before it, by name.
+Arg = namedtuple("Arg", ["name", "type", "default"])
+
+def arg(name, type=str, default=REQUIRED):
+    return Arg(name, type, default)
+
+# args is None for commands that parse context.args themselves. public commands
+# skip the permission check; writing commands work while a register is active.
+Command = namedtuple("Command",
+    ["name", "callback", "args", "usage", "description", "public", "writing"])
+
+def command(name, callback, args=(), usage=None, description="",
+        public=False, writing=False):
+    if usage is None:
+        usage = " ".join(
+            ("<{}>" if a.default is REQUIRED else "[{}]").format(a.name)
+            for a in args)
+    return Command(name, callback, None if args is None else tuple(args),
+        usage, description, public, writing)
+
+# Type for arguments that take one of a few words.
+def choice(*options):
+    def convert(text):
+        if text not in options:
+            raise ValueError(text)
+        return text
+    return convert
+
+# Type for counts: whole numbers from 1.
+def positive(text):
+    value = int(text)
+    if value < 1:
+        raise ValueError(text)
+    return value
+
+class UsageError(Exception):
+    pass
+
+def usage(command):
+    return " ".join(filter(None, ["/" + command.name, command.usage]))
+
+# Returns the converted arguments in order, with the defaults filled in.
+def parse(command, args):
+    if command.args is None:
+        return list(args)
+
+    required = sum(a.default is REQUIRED for a in command.args)
+    if not required <= len(args) <= len(command.args):
+        raise UsageError(usage(command))
+
+    values = {}
+    for i, a in enumerate(command.args):
+        if i < len(args):
+            try:
+                values[a.name] = a.type(args[i])
+            except ValueError:
+                raise UsageError(usage(command))
+        elif callable(a.default):
+            values[a.name] = a.default(values)
+        else:
+            values[a.name] = a.default
+    return [values[a.name] for a in command.args]
+
+# Wraps the command's callback so it gets context.args already parsed. Wrong
+# arguments get the usage as reply. If check is given the command only runs
+# when check(update, context) is true; it runs in the same order as the
+# callback, after the user's earlier updates.
+def handler(command, check=None):
+    @functools.wraps(command.callback)
+    def callback(update, context):
+        if check is not None and not check(update, context):
+            return
+        try:
+            context.args = parse(command, context.args or [])
+        except UsageError as e:
+            context.bot.send_message(chat_id=update.effective_chat.id,
+                text="Correct format: {}".format(e),
+                disable_notification=True)
+            return
+        return command.callback(update, context)
+    return callback
+
+# The /help message. Rendered once per registration, not on every /help.
+def render_help(commands):
+    return "\n\n".join("{}: {}".format(usage(c), c.description)
+        for c in commands)
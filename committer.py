@@ -0,0 +1,128 @@
+import logging
+import os
+import subprocess as subproc
+import threading
+from time import sleep
+
+import settings
+import stats
+
+###
+# Commit queue. Handlers queue their edits and return; a worker thread stages
+# only the touched paths and commits every edit that arrived within
+# settings.COMMIT_WINDOW as a single commit.
+###
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+# Seconds before a failed commit is tried again.
+RETRY_DELAY = 10
+
+logger = logging.getLogger(__name__)
+
+# pending = [(message, [path])]
+pending = []
+condition = threading.Condition()
+# Held while git runs, so the worker and flush() never commit at the same time.
+commit_lock = threading.Lock()
+worker = None
+
+def queue_commit(message, paths):
+    global worker
+    with condition:
+        pending.append((message, list(paths)))
+        if worker is None:
+            worker = threading.Thread(target=work, name="committer",
+                daemon=True)
+            worker.start()
+        condition.notify()
+
+# Commits whatever is queued right now. Called before the process stops.
+def flush():
+    with commit_lock:
+        commit(take_pending())
+
+def take_pending():
+    global pending
+    with condition:
+        batch = pending
+        pending = []
+    return batch
+
+def work():
+    while True:
+        with condition:
+            while not pending:
+                condition.wait()
+        # Lets more edits pile up before committing.
+        sleep(settings.COMMIT_WINDOW)
+        with commit_lock:
+            batch = take_pending()
+            try:
+                commit(batch)
+                continue
+            except:
+                logger.exception("Commit failed, retrying in %s s.",
+                    RETRY_DELAY)
+            # The edits stay queued, ahead of the ones that came since.
+            with condition:
+                pending[:0] = batch
+        sleep(RETRY_DELAY)
+
+# Paths outside of the repository can't be committed, so they're dropped.
+def repo_paths(paths):
+    inside = []
+    for path in paths:
+        path = os.path.realpath(path)
+        if os.path.commonpath([REPO, path]) == REPO and path != REPO:
+            inside.append(os.path.relpath(path, REPO))
+    return inside
+
+# Ignored files can't be added (git add fails on them), unless they're
+# tracked already, which check-ignore doesn't report.
+def ignored(paths):
+    result = subproc.run(["git", "check-ignore", "-z", "--stdin"], cwd=REPO,
+        input='\0'.join(paths), stdout=subproc.PIPE, encoding="UTF-8")
+    # 1 means none of them is ignored.
+    if result.returncode not in [0, 1]:
+        raise subproc.CalledProcessError(result.returncode, result.args)
+    return set(p for p in result.stdout.split('\0') if p)
+
+def join_messages(messages):
+    if len(messages) == 1:
+        return messages[0]
+    return "{} edits.\n\n{}".format(len(messages), '\n'.join(messages))
+
+@stats.timed("git commit")
+def commit(batch):
+    if not batch:
+        return
+
+    paths = []
+    for _, p in batch:
+        paths += repo_paths(p)
+    paths = sorted(set(paths))
+    if paths:
+        skipped = ignored(paths)
+        paths = [p for p in paths if p not in skipped]
+    if not paths:
+        return
+
+    # git add fails on a path that's gone from the index already.
+    present = [p for p in paths if os.path.lexists(os.path.join(REPO, p))]
+    missing = [p for p in paths if p not in present]
+    if present:
+        subproc.run(["git", "add", "-A", "--"] + present, cwd=REPO, check=True)
+    if missing:
+        subproc.run(["git", "rm", "-q", "--cached", "--ignore-unmatch", "--"]
+            + missing, cwd=REPO, check=True)
+    # Nothing staged means the edits didn't change anything. Only these paths
+    # are committed, whatever else happens to be staged.
+    changed = subproc.run(["git", "diff", "--cached", "--name-only", "-z",
+        "--"] + paths, cwd=REPO, check=True, stdout=subproc.PIPE,
+        encoding="UTF-8").stdout.split('\0')
+    changed = [p for p in changed if p]
+    if not changed:
+        return
+    message = join_messages([m for m, _ in batch])
+    subproc.run(["git", "commit", "-q", "-m", message, "--"] + changed,
+        cwd=REPO, check=True)
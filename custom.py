@@ -1,2 +0,0 @@
-def core(update, context):
-    return
@@ -0,0 +1,132 @@
+import codecs
+import http.client
+import json
+import logging
+import os
+import secrets
+import tempfile
+import time
+from urllib.parse import urlsplit
+import urllib.request
+
+import lineindex
+import stats
+
+###
+# Documents. Files go in and out as Telegram documents instead of text
+# messages. Downloads are decoded chunk by chunk as they arrive. Uploads are
+# streamed from disk in a multipart body whose length is known beforehand.
+# python-telegram-bot reads files into memory whole, so both go over HTTP
+# directly.
+###
+
+CHUNK = 1 << 16
+TIMEOUT = 60
+
+logger = logging.getLogger(__name__)
+
+class DocumentError(Exception):
+    pass
+
+def log_throughput(name, size, elapsed):
+    stats.record("document " + name, elapsed)
+    logger.info("%s %d B in %.2f s (%.2f MB/s).", name.capitalize(), size,
+        elapsed, size / max(elapsed, 1e-9) / 2 ** 20)
+
+# Streams the document and calls consume() with its text, a piece at a time.
+# Returns its size in bytes. Raises UnicodeDecodeError if it isn't UTF-8.
+def download(bot, document, limit, consume):
+    if document.file_size and document.file_size > limit:
+        raise DocumentError("Documents can't be bigger than {} B.".format(limit))
+
+    start = time.perf_counter()
+    file = bot.get_file(document.file_id)
+    decoder = codecs.getincrementaldecoder("UTF-8")()
+    size = 0
+    with urllib.request.urlopen(file.file_path, timeout=TIMEOUT) as response:
+        while True:
+            chunk = response.read(CHUNK)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > limit:
+                raise DocumentError(
+                    "Documents can't be bigger than {} B.".format(limit))
+            consume(decoder.decode(chunk))
+    consume(decoder.decode(b"", final=True))
+
+    log_throughput("download", size, time.perf_counter() - start)
+    return size
+
+# Copies lines line_start to line_end of filename into a temporary file.
+def extract_lines(filename, line_start, line_end):
+    f = tempfile.TemporaryFile()
+    try:
+        for line in lineindex.iter_lines(filename, line_start, line_end):
+            f.write(line.encode("UTF-8") + b'\n')
+        f.seek(0)
+    except:
+        f.close()
+        raise
+    return f
+
+def multipart(boundary, fields, name, f, size):
+    head = b""
+    for key, value in fields.items():
+        head += ("--{}\r\nContent-Disposition: form-data; name=\"{}\"\r\n\r\n"
+            "{}\r\n").format(boundary, key, value).encode("UTF-8")
+    head += ("--{}\r\nContent-Disposition: form-data; name=\"document\"; "
+        "filename=\"{}\"\r\nContent-Type: application/octet-stream\r\n\r\n"
+        ).format(boundary, name.replace('"', "'")).encode("UTF-8")
+    tail = "\r\n--{}--\r\n".format(boundary).encode("UTF-8")
+
+    def body():
+        yield head
+        while True:
+            chunk = f.read(CHUNK)
+            if not chunk:
+                break
+            yield chunk
+        yield tail
+    return body(), len(head) + size + len(tail)
+
+# Sends filename, or only its lines line_start to line_end, to chat_id.
+# Returns the bytes sent.
+def upload(bot, chat_id, filename, limit, line_start=None, line_end=None):
+    if line_start is None:
+        f = open(filename, "rb")
+        name = os.path.basename(filename)
+    else:
+        f = extract_lines(filename, line_start, line_end)
+        name = "{}.{}-{}".format(os.path.basename(filename), line_start,
+            line_end)
+
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        if size > limit:
+            raise DocumentError(
+                "Documents can't be bigger than {} B.".format(limit))
+
+        start = time.perf_counter()
+        boundary = secrets.token_hex(16)
+        body, length = multipart(boundary, {"chat_id": chat_id,
+            "disable_notification": "true"}, name, f, size)
+        url = urlsplit(bot.base_url + "/sendDocument")
+        if url.scheme == "https":
+            connection = http.client.HTTPSConnection(url.netloc,
+                timeout=TIMEOUT)
+        else:
+            connection = http.client.HTTPConnection(url.netloc,
+                timeout=TIMEOUT)
+        try:
+            connection.request("POST", url.path, body=body, headers={
+                "Content-Type": "multipart/form-data; boundary=" + boundary,
+                "Content-Length": str(length)})
+            result = json.loads(connection.getresponse().read())
+        finally:
+            connection.close()
+        if not result.get("ok"):
+            raise DocumentError(result.get("description", "Upload failed."))
+
+    log_throughput("upload", size, time.perf_counter() - start)
+    return size
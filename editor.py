@@ -0,0 +1,271 @@
+from collections import OrderedDict
+from contextlib import contextmanager, ExitStack
+import os
+import tempfile
+import threading
+
+import settings
+import stats
+import syntax
+
+###
+# Line editor. Files are read once into a buffer of lines (without their
+# newlines), the edit is applied to the buffer, and the result is written back
+# atomically with a single trailing newline. Line numbers start at 1, like sed.
+###
+
+###
+# Concurrency. An edit holds the lock of its file from the read to the write,
+# so edits of one file never interleave while edits of different files run in
+# parallel. Edits computed earlier against a file (a queued transaction) check
+# its version, the inode, size and mtime it had then, before being written.
+###
+
+class StaleFile(Exception):
+    pass
+
+# A reload (see reloader.py) runs this module again; edits in progress must
+# keep their locks.
+try:
+    locks
+except NameError:
+    # locks = {path: RLock}
+    locks = {}
+    locks_lock = threading.Lock()
+
+def lock_for(filename):
+    path = os.path.abspath(filename)
+    with locks_lock:
+        lock = locks.get(path)
+        if lock is None:
+            lock = locks[path] = threading.RLock()
+        return lock
+
+# Holds the locks of several files, always taken in the same order.
+@contextmanager
+def locked(filenames):
+    with ExitStack() as stack:
+        for path in sorted(set(os.path.abspath(f) for f in filenames)):
+            stack.enter_context(lock_for(path))
+        yield
+
+def stat_version(stat):
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+# None if the file doesn't exist.
+def version(filename):
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return stat_version(stat)
+
+# Call with the file's lock held.
+def check_version(filename, expected):
+    if version(filename) != expected:
+        raise StaleFile("{} changed in the meantime.".format(filename))
+
+###
+# Buffer cache. The lines of the files read or written last are kept, up to
+# settings.BUFFER_CACHE_BYTES, so a session of edits to the same few files
+# doesn't read them again every time. A buffer is only used while the file
+# has the version it was cached with, so edits made outside the bot are
+# picked up. Buffers are shared: they must never be modified in place, which
+# the buffer operations below don't.
+###
+
+try:
+    buffers
+except NameError:
+    # buffers = {path: (version, lines, size)}, least recently used first.
+    buffers = OrderedDict()
+    buffers_lock = threading.Lock()
+    cache_hits = 0
+    cache_misses = 0
+    cached_bytes = 0
+
+stats.gauge("buffer cache hits", lambda: cache_hits)
+stats.gauge("buffer cache misses", lambda: cache_misses)
+stats.gauge("buffer cache bytes", lambda: cached_bytes)
+
+# Roughly what the list and its strings take up.
+def buffer_size(lines):
+    return sum(map(len, lines)) + 64 * len(lines)
+
+def cached(path, version):
+    global cache_hits, cache_misses
+    with buffers_lock:
+        entry = buffers.get(path)
+        if entry is None or entry[0] != version:
+            cache_misses += 1
+            return None
+        cache_hits += 1
+        buffers.move_to_end(path)
+        return entry[1]
+
+def remember(path, version, lines):
+    global cached_bytes
+    size = buffer_size(lines)
+    with buffers_lock:
+        old = buffers.pop(path, None)
+        if old is not None:
+            cached_bytes -= old[2]
+        if size > settings.BUFFER_CACHE_BYTES:
+            return
+        buffers[path] = (version, lines, size)
+        cached_bytes += size
+        while cached_bytes > settings.BUFFER_CACHE_BYTES:
+            _, (_, _, evicted) = buffers.popitem(last=False)
+            cached_bytes -= evicted
+
+# The file's lines if they're cached and current, without reading it.
+def buffered(filename):
+    path = os.path.abspath(filename)
+    with buffers_lock:
+        entry = buffers.get(path)
+    if entry is None or entry[0] != version(path):
+        return None
+    return entry[1]
+
+# Splits text into lines. A single trailing newline doesn't make an extra line.
+def split_lines(text):
+    if not text:
+        return []
+    lines = text.split('\n')
+    if lines[-1] == "":
+        lines.pop()
+    return lines
+
+def read_lines(filename):
+    path = os.path.abspath(filename)
+    # newline='' keeps '\r' in place, so files are written back untouched.
+    with open(path, 'r', encoding="UTF-8", newline='') as f:
+        file_version = stat_version(os.fstat(f.fileno()))
+        lines = cached(path, file_version)
+        if lines is not None:
+            return lines
+        lines = read_file(f)
+    remember(path, file_version, lines)
+    return lines
+
+@stats.timed("file read")
+def read_file(f):
+    return split_lines(f.read())
+
+# Writes to a temporary file on the same directory and then renames it over the
+# original, so readers never see a half written file. Python files are checked
+# first, see check_syntax.
+@stats.timed("file write")
+def write_lines(filename, lines, check=True):
+    with lock_for(filename):
+        if check:
+            check_syntax(filename, lines)
+        write_unlocked(filename, lines)
+
+# Raises syntax.SyntaxCheckError if lines would break a Python file. A file
+# that didn't compile before isn't held to it, so it can be fixed a step at a
+# time.
+@stats.timed("syntax check")
+def check_syntax(filename, lines):
+    try:
+        syntax.check(filename, lines)
+    except syntax.SyntaxCheckError:
+        if compiled_before(filename):
+            raise
+
+def compiled_before(filename):
+    try:
+        syntax.check(filename, read_lines(filename))
+    except FileNotFoundError:
+        return True
+    except (syntax.SyntaxCheckError, UnicodeDecodeError):
+        return False
+    return True
+
+# The umask can only be read by setting it, so it's read once, before any
+# thread creates files; a reload keeps it.
+try:
+    UMASK
+except NameError:
+    UMASK = os.umask(0)
+    os.umask(UMASK)
+
+def write_unlocked(filename, lines):
+    directory = os.path.dirname(os.path.abspath(filename))
+    # mkstemp creates the file with 0600. New files get the mode open() would
+    # give them.
+    try:
+        mode = os.stat(filename).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = 0o666 & ~UMASK
+
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".edit-")
+    try:
+        with os.fdopen(fd, 'w', encoding="UTF-8", newline='') as f:
+            if lines:
+                f.write('\n'.join(lines))
+                f.write('\n')
+        os.chmod(tmp, mode)
+        # The rename keeps the inode and mtime, so this is the version the
+        # file will have.
+        file_version = version(tmp)
+        os.replace(tmp, filename)
+    except:
+        os.unlink(tmp)
+        raise
+    remember(os.path.abspath(filename), file_version, lines)
+
+# Buffer operations. They return a new list and leave the given one untouched.
+
+# Inserts before line. Past the end of the buffer it appends.
+def insert_into_buffer(lines, line, text):
+    if line < 1:
+        raise ValueError("Invalid line {}.".format(line))
+    return lines[:line - 1] + split_lines(text) + lines[line - 1:]
+
+# Deletes from line_start to line_end. Like sed, a line_end before line_start
+# only deletes line_start.
+def delete_from_buffer(lines, line_start, line_end):
+    if line_start < 1:
+        raise ValueError("Invalid line {}.".format(line_start))
+    line_end = max(line_start, line_end)
+    return lines[:line_start - 1] + lines[line_end:]
+
+def replace_in_buffer(lines, line_start, line_end, text):
+    lines = delete_from_buffer(lines, line_start, line_end)
+    return insert_into_buffer(lines, line_start, text)
+
+def append_to_buffer(lines, text):
+    return lines + split_lines(text)
+
+# File operations. One read and one write each, under the file's lock.
+
+# Writes change(lines) over the file's lines. Returns the lines it had.
+def edit(filename, change):
+    with lock_for(filename):
+        lines = read_lines(filename)
+        write_lines(filename, change(lines))
+        return lines
+
+def insert(filename, line, text):
+    edit(filename, lambda lines: insert_into_buffer(lines, line, text))
+
+def delete(filename, line_start, line_end):
+    edit(filename,
+        lambda lines: delete_from_buffer(lines, line_start, line_end))
+
+def replace(filename, line_start, line_end, text):
+    edit(filename,
+        lambda lines: replace_in_buffer(lines, line_start, line_end, text))
+
+def append(filename, text):
+    edit(filename, lambda lines: append_to_buffer(lines, text))
+
+# Fails if the file already exists.
+def create(filename, text):
+    lines = split_lines(text)
+    syntax.check(filename, lines)
+    with open(filename, 'x', encoding="UTF-8", newline='') as f:
+        if lines:
+            f.write('\n'.join(lines))
+            f.write('\n')
@@ -0,0 +1,202 @@
+import email.parser
+import email.policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+from urllib.parse import parse_qsl
+
+###
+# A local stand-in for the Telegram Bot API, to run the bot offline (see
+# bench.py replay). getUpdates serves the updates given to script(), with
+# long polling and offsets like the real one; sendMessage and the other
+# methods are recorded and answered with plausible results. Point the bot at
+# it with bot.create(token, server.base_url, server.base_file_url).
+# Documents given to add_file() can be downloaded through getFile; sent
+# documents are recorded with their size instead of their content.
+###
+
+ME = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+# An update with a message from user_id in their private chat. Commands get
+# the entity that CommandHandler looks for.
+def message_update(update_id, user_id, text):
+    user = {"id": user_id, "is_bot": False, "first_name": "user"}
+    message = {"message_id": update_id, "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"}, "from": user,
+        "text": text}
+    if text.startswith('/'):
+        message["entities"] = [{"type": "bot_command", "offset": 0,
+            "length": len(text.split(' ')[0])}]
+    return {"update_id": update_id, "message": message}
+
+# An update with a document, added with FakeBotAPI.add_file, from user_id.
+def document_update(update_id, user_id, file_id, size, name="document.txt"):
+    update = message_update(update_id, user_id, "")
+    del update["message"]["text"]
+    update["message"]["document"] = {"file_id": file_id,
+        "file_unique_id": file_id, "file_name": name, "file_size": size}
+    return update
+
+# Returns the fields of a multipart/form-data body. Files are replaced by
+# their size.
+def parse_multipart(content_type, body):
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+    params = {}
+    for part in message.iter_parts():
+        content = part.get_payload(decode=True)
+        if part.get_filename() is not None:
+            params[part.get_param("name", header="content-disposition")] = {
+                "file_name": part.get_filename(), "size": len(content)}
+        else:
+            params[part.get_param("name", header="content-disposition")] = \
+                content.decode("UTF-8")
+    return params
+
+class FakeBotAPI(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0)):
+        super().__init__(address, FakeBotAPIHandler)
+        self.condition = threading.Condition()
+        self.updates = []
+        # When each update was handed to the bot, by update_id.
+        self.served = {}
+        # [(time, method, params)]
+        self.calls = []
+        self.next_message_id = 1
+        # {file_id: content}
+        self.files = {}
+        self.closed = False
+
+    @property
+    def base_url(self):
+        return "http://{}:{}/bot".format(*self.server_address)
+
+    @property
+    def base_file_url(self):
+        return "http://{}:{}/file/bot".format(*self.server_address)
+
+    # Returns the file_id to send content with in a document_update.
+    def add_file(self, content):
+        with self.condition:
+            file_id = "file{}".format(len(self.files) + 1)
+            self.files[file_id] = content
+            return file_id
+
+    def script(self, updates):
+        with self.condition:
+            self.updates += updates
+            self.condition.notify_all()
+
+    def sent(self, method="sendMessage"):
+        with self.condition:
+            return [(t, params) for t, m, params in self.calls if m == method]
+
+    # Waits until done(calls) is true. Returns False on timeout.
+    def wait(self, done, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(lambda: done(self.calls), timeout)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.shutdown()
+        self.server_close()
+
+    def get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                pending = [u for u in self.updates if u["update_id"] >= offset]
+                remaining = deadline - time.monotonic()
+                if pending or remaining <= 0 or self.closed:
+                    break
+                self.condition.wait(remaining)
+            # Confirmed updates are dropped, like Telegram does.
+            self.updates = pending
+            pending = pending[:limit]
+            now = time.perf_counter()
+            for u in pending:
+                self.served.setdefault(u["update_id"], now)
+            return pending
+
+    def call(self, method, params):
+        with self.condition:
+            self.calls.append((time.perf_counter(), method, params))
+            self.condition.notify_all()
+            message_id = self.next_message_id
+            self.next_message_id += 1
+
+        if method == "getUpdates":
+            return self.get_updates(params)
+        if method == "getMe":
+            return ME
+        if method == "getFile":
+            file_id = params.get("file_id")
+            return {"file_id": file_id, "file_unique_id": file_id,
+                "file_size": len(self.files[file_id]),
+                "file_path": "documents/" + file_id}
+        if method in ["sendMessage", "sendDocument"]:
+            chat_id = int(params.get("chat_id", 0))
+            return {"message_id": message_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "from": ME,
+                "text": params.get("text", "")}
+        return True
+
+class FakeBotAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("application/json"):
+            params = json.loads(body or b"{}")
+        elif content_type.startswith("multipart/form-data"):
+            params = parse_multipart(content_type, body)
+        else:
+            params = dict(parse_qsl(body.decode("UTF-8", "replace")))
+        self.reply(params)
+
+    def do_GET(self):
+        if self.path.startswith("/file/"):
+            self.download()
+            return
+        self.reply(dict(parse_qsl(self.path.partition('?')[2])))
+
+    # Serves /file/bot<token>/documents/<file_id>.
+    def download(self):
+        content = self.server.files.get(self.path.rsplit('/', 1)[-1])
+        if content is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def reply(self, params):
+        method = self.path.partition('?')[0].rsplit('/', 1)[-1]
+        result = self.server.call(method, params)
+        body = json.dumps({"ok": True, "result": result}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start(address=("127.0.0.1", 0)):
+    server = FakeBotAPI(address)
+    threading.Thread(target=server.serve_forever, name="fakeapi",
+        daemon=True).start()
+    return server
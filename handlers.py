@@ -0,0 +1,921 @@
+#-------#
+# Init. #
+#-------#
+
+from telegram import Update
+from telegram.ext import (CallbackQueryHandler, CommandHandler,
+    DispatcherHandlerStop, Filters, MessageHandler, TypeHandler)
+import acl
+import aio
+import commands
+import documents
+import editor
+import history
+import itertools
+import journal
+import lineindex
+import listing
+import logging
+import outbox
+import output
+import plugins
+from registers import Register
+import re
+import reloader
+import search
+import settings
+import stats
+import syntax
+import time
+import transactions
+import utils
+
+###
+# Permissions. Only certain users can run certain commands. The users are
+# registered with their user_ids on the file "allowed_users" (see acl.py).
+# guard() checks every update before any handler sees it.
+###
+
+# Commands anyone can run. Filled by register() from the registry below.
+PUBLIC_COMMANDS = set()
+# The /help message.
+HELP = ""
+
+###
+# ROM. Stores "registries" for users in which registers store strings.
+###
+
+# rom = {user_id: [active_label, {label: Register}]}
+# A reload (see reloader.py) runs this module again; the rom must survive it.
+try:
+    rom
+except NameError:
+    rom = journal.load()
+
+#----------------------#
+#  Handler functions.  #
+#----------------------#
+
+###
+# Generic bot functions.
+###
+
+# Called with: /ping
+def ping(update, context):
+    context.bot.send_message(chat_id=update.effective_chat.id, text="Pong.",
+        disable_notification=True)
+
+# Called with: /help
+# The message is rendered from the registry by register(). Plugins can change
+# at any time, so their commands are added here.
+def help(update, context):
+    text = HELP
+    names = plugins.command_names()
+    if names:
+        text += "\n\nPlugin commands: " + ", ".join("/" + n for n in names)
+    context.bot.send_message(chat_id=update.effective_chat.id,
+            text=text,
+        disable_notification=True)
+
+# Called with: /restart [full]
+# Reloads the handlers in place. A full restart assumes that this file is being
+# run with a wrapper that restarts it, and is needed for changes to bot.py.
+def restart_bot(update, context):
+    mode, = context.args
+    if mode == "full":
+        outbox.flush(settings.SEND_FLUSH_TIMEOUT)
+        utils.stop_process()
+        return
+
+    try:
+        elapsed = reloader.reload(context.dispatcher)
+    except Exception as e:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="Reload failed, restarting: {!r}".format(e),
+            disable_notification=True)
+        outbox.flush(settings.SEND_FLUSH_TIMEOUT)
+        utils.stop_process()
+        return
+
+    context.bot.send_message(chat_id=update.effective_chat.id,
+        text="Reloaded in {:.0f} ms. Edits to {} need /restart full.".format(
+            elapsed * 1000, ", ".join(m + ".py" for m in reloader.KEPT)),
+        disable_notification=True)
+    # The old handlers of the other groups must not see this update.
+    raise DispatcherHandlerStop
+
+# Called with: /stats
+def show_stats(update, context):
+    lines = stats.report()
+    if not lines:
+        lines = ["Nothing measured yet."]
+    output.send_pages(update, context, output.paginate(lines))
+
+# The bot will send all errors. Unauthorized updates never get this far.
+def callback(update, context):
+    context.bot.send_message(chat_id=update.effective_chat.id,
+        text=repr(context.error),
+        disable_notification=True)
+
+# Runs before every handler and stops unauthorized updates. An update the guard
+# fails on is stopped too: the handlers of the next groups would otherwise still
+# get it.
+def guard(update, context):
+    try:
+        admitted = admit(update, context)
+    except:
+        logging.exception("Guard failed, rejecting the update.")
+        user = update.effective_user
+        acl.reject(user.id if user else None, None)
+        admitted = False
+    if not admitted:
+        raise DispatcherHandlerStop
+
+def admit(update, context):
+    command = acl.command_of(update)
+    if command in PUBLIC_COMMANDS:
+        return True
+
+    user = update.effective_user
+    if user is None or not acl.allowed(user.id, command):
+        acl.reject(user.id if user else None, command)
+        return False
+    return True
+
+# Commands other than the writing ones need the active register released
+# first. Checked with the command, not in the guard: in asyncio mode the user's
+# earlier updates, like the /ni releasing it, may not have run yet.
+def register_released(update, context):
+    return not utils.must_release_rom(rom, update, context)
+
+###
+# Register functions. Users load registers with information and then write the
+# content of those registers into files.
+###
+
+# Only one register per user can be in use at a time. When a register is in use
+# by a user, the bot will ignore most commands until that register is
+# "released."
+
+# Called with: /in <label>
+def register_request(update, context):
+    global rom
+
+    label, = context.args
+
+    rom = utils.create_registry_if_inexistent(rom, update)
+
+    # Marks the label as active.
+    rom[update.effective_user.id][0] = label
+
+# It inserts any message from a user into the user's active register.
+def register_insert(update, context):
+    global rom
+
+    if not utils.writing_to_rom(rom, update):
+        return
+
+    label = rom[update.effective_user.id][0]
+
+    # Sets up register to be written on.
+    if label not in rom[update.effective_user.id][1].keys():
+        rom[update.effective_user.id][1][label] = Register()
+
+    # Writes message to register.
+    rom[update.effective_user.id][1][label].append(update.message.text)
+
+# A document sent while a register is active goes into it whole, like one long
+# message.
+def register_document(update, context):
+    global rom
+
+    if not utils.writing_to_rom(rom, update):
+        return
+
+    label = rom[update.effective_user.id][0]
+
+    # Downloads the document, decoding it as it arrives.
+    pieces = []
+    try:
+        size = documents.download(context.bot, update.message.document,
+            settings.DOCUMENT_DOWNLOAD_LIMIT, pieces.append)
+    except documents.DocumentError as e:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text=str(e),
+            disable_notification=True)
+        return
+    except UnicodeDecodeError:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="Only UTF-8 text goes into registers.",
+            disable_notification=True)
+        return
+    except:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="-1",
+            disable_notification=True)
+        return
+    text = ''.join(pieces)
+    if text.endswith('\n'):
+        text = text[:-1]
+
+    # Sets up register to be written on.
+    if label not in rom[update.effective_user.id][1].keys():
+        rom[update.effective_user.id][1][label] = Register()
+
+    rom[update.effective_user.id][1][label].append(text)
+    context.bot.send_message(chat_id=update.effective_chat.id,
+        text="{} B added to register {}.".format(size, label),
+        disable_notification=True)
+
+# Called with: /ni
+def register_release(update, context):
+    global rom
+
+    # Checks if there's a label to release.
+    if not utils.writing_to_rom(rom, update):
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="No register to release.",
+            disable_notification=True)
+        return
+    label = rom[update.effective_user.id][0]
+
+    # Sets the active label as None.
+    rom[update.effective_user.id][0] = None
+
+    # Saves the register for persistance. Nothing to save if no message
+    # arrived.
+    if label in rom[update.effective_user.id][1].keys():
+        rom[update.effective_user.id][1][label].freeze()
+        journal.set_register(rom, update.effective_user.id, label)
+
+# Some functions to read registers.
+
+# Called with: /regs
+def registry_show(update, context):
+    global rom
+
+    rom = utils.create_registry_if_inexistent(rom, update)
+
+    # Compose message. Each register comes with its size and the memory it
+    # takes up, which is less if it's compressed or shared.
+    entries = []
+    for label, register in list(rom[update.effective_user.id][1].items()):
+        size, stored, shared = register.sizes()
+        entries.append("{} ({} B, {} B stored{})".format(label, size, stored,
+            ", shared" if shared else ""))
+    entries = entries or [""]
+    entries[0] = "Registers: " + entries[0]
+    entries[-1] += '.'
+
+    output.send_pages(update, context, output.paginate(entries, ", "))
+
+# Called with: /print <label>
+def register_print(update, context):
+    global rom
+
+    label, = context.args
+
+    if utils.register_is_empty(rom, label, update, context):
+        return
+
+    content = rom[update.effective_user.id][1][label].text()
+    output.send_pages(update, context, output.paginate(content.split('\n')))
+
+# Some functions to clear registers.
+
+# Called with: /clear <label>
+def register_clear(update, context):
+    global rom
+
+    label, = context.args
+
+    if utils.register_is_empty(rom, label, update, context):
+        return
+
+    # Clears register.
+    rom[update.effective_user.id][1].pop(label).discard()
+
+    journal.delete_register(rom, update.effective_user.id, label)
+
+# Called with: /clear_all
+def rom_clear(update, context):
+    global rom
+
+    # Clear user's rom.
+    if update.effective_user.id in rom.keys():
+        for register in rom.pop(update.effective_user.id)[1].values():
+            register.discard()
+
+    journal.clear_registry(rom, update.effective_user.id)
+
+###
+# File system functions. These provide capabilities for writing to, reading
+# from, deleting, and creating files. Edits go through editor.py, reads
+# through lineindex.py and listings through listing.py.
+###
+
+# Functions to read from the file system.
+
+# Called with: /ls [-l] [-R] [dir] [pattern]
+def explore_directory(update, context):
+    # Input curation. -l adds size and mtime, -R lists recursively.
+    flags = [a for a in context.args if a.startswith('-')]
+    args = [a for a in context.args if not a.startswith('-')]
+    if len(args) > 2 or any(f not in ["-l", "-R"] for f in flags):
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="Correct format: " + commands.usage(LS),
+            disable_notification=True)
+        return
+    directory = args[0] if args else "."
+    pattern = args[1] if len(args) == 2 else None
+    long = "-l" in flags
+
+    try:
+        if "-R" in flags:
+            out = listing.walk(directory, pattern, long)
+        else:
+            out = listing.list_directory(directory, pattern, long)
+    except:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="-1",
+            disable_notification=True)
+        return
+
+    # Response composition. One entry per line in the long and recursive
+    # formats.
+    sep = '\n' if long or "-R" in flags else ", "
+    output.send_pages(update, context, output.paginate(out, sep))
+
+# Called with: /read <file> [line_start] [line_end]
+def read_lines_from_file(update, context):
+    filename, line_start, line_end = context.args
+
+    # Gets the requested lines through the file's line index.
+    # Lines are read as the pages are sent: from the file's buffer if it's
+    # cached (see editor.py), through its line index otherwise.
+    try:
+        lines = editor.buffered(filename)
+        if lines is not None and line_start >= 1:
+            out = iter(lines[line_start - 1:line_end])
+        else:
+            out = lineindex.iter_lines(filename, line_start, line_end)
+        first = next(out, None)
+    except:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="-1",
+            disable_notification=True)
+        return
+    if first is None:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="No lines.",
+            disable_notification=True)
+        return
+
+    # Adds line number to output.
+    numbered = (str(i + line_start) + ' ' + l
+        for i, l in enumerate(itertools.chain([first], out)))
+    output.send_pages(update, context, output.paginate(numbered))
+
+# Called with: /get <file> [line_start] [line_end]
+def send_file(update, context):
+    filename, line_start, line_end = context.args
+
+    # Streams the file, or the lines, from disk as a document.
+    try:
+        documents.upload(context.bot, update.effective_chat.id, filename,
+            settings.DOCUMENT_UPLOAD_LIMIT, line_start, line_end)
+    except documents.DocumentError as e:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text=str(e),
+            disable_notification=True)
+    except:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="-1",
+            disable_notification=True)
+
+# Called with: /grep [-i] [-C <lines>] <pattern> <file> [file ...]
+def search_files(update, context):
+    # Input curation. -i ignores case, -C adds lines of context.
+    args = list(context.args)
+    ignore_case = False
+    lines = 0
+    try:
+        while args and args[0].startswith('-'):
+            flag = args.pop(0)
+            if flag == "-i":
+                ignore_case = True
+            elif flag == "-C":
+                lines = int(args.pop(0))
+            else:
+                raise ValueError(flag)
+        if len(args) < 2 or lines < 0:
+            raise ValueError(args)
+    except (ValueError, IndexError):
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="Correct format: " + commands.usage(GREP),
+            disable_notification=True)
+        return
+
+    try:
+        out = search.grep(args[0], args[1:], lines, ignore_case)
+        first = next(out, None)
+    except re.error as e:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="Invalid pattern: {}".format(e),
+            disable_notification=True)
+        return
+    except:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="-1",
+            disable_notification=True)
+        return
+    if first is None:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="No matches.",
+            disable_notification=True)
+        return
+
+    output.send_pages(update, context,
+        output.paginate(itertools.chain([first], out)))
+
+# Functions to edit files from the file system.
+
+# Inside a transaction edits wait for /commit. Returns True if the edit was
+# queued.
+def queued(update, context, edit):
+    if not transactions.active(update.effective_user.id):
+        return False
+    transactions.queue(update.effective_user.id, edit)
+    context.bot.send_message(chat_id=update.effective_chat.id,
+        text="Queued.",
+        disable_notification=True)
+    return True
+
+# Called with: /new <label> <file>
+def dump_to_new_file(update, context):
+    label, filename = context.args
+
+    if utils.register_is_empty(rom, label, update, context):
+        return
+
+    # Dump to file.
+    content = rom[update.effective_user.id][1][label].text()
+    message = "Wrote register {} to file {}.".format(label, filename)
+
+    if queued(update, context,
+            transactions.Edit("new", filename, 1, 1, content, message)):
+        return
+
+    try:
+        editor.create(filename, content)
+    except syntax.SyntaxCheckError as e:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="Nothing written. {}".format(e),
+            disable_notification=True)
+        return
+    except:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="-1",
+            disable_notification=True)
+        return
+    
+    utils.git_commit(message, [filename])
+    return
+
+# Called with: /inject <label> <file> [line]
+def inject_into_existing_file(update, context):
+    label, filename, line = context.args
+
+    if utils.register_is_empty(rom, label, update, context):
+        return
+
+    content = rom[update.effective_user.id][1][label].text()
+    message = "Injected contents of register {} into line {} of file {}.".format(label, line, filename)
+
+    if queued(update, context,
+            transactions.Edit("insert", filename, line, line, content, message)):
+        return
+
+    # Inserts to file. Past the end of the file the register is appended. The
+    # length is the one the file had under the lock, right before the edit.
+    try:
+        lines = editor.edit(filename,
+            lambda lines: editor.insert_into_buffer(lines, line, content))
+    except syntax.SyntaxCheckError as e:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="Nothing written. {}".format(e),
+            disable_notification=True)
+        return
+    except:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="-1",
+            disable_notification=True)
+        return
+
+    if line > len(lines):
+        utils.git_commit("Appended contents of register {} to file {}.".format(label, filename),
+            [filename])
+        return
+
+    utils.git_commit(message, [filename])
+    return
+
+# Called with: /overwrite <label> <file> <line_start> [line_end]
+def overwrite_lines_in_file(update, context):
+    label, filename, line_start, line_end = context.args
+
+    if utils.register_is_empty(rom, label, update, context):
+        return
+
+    content = rom[update.effective_user.id][1][label].text()
+    message = "Overwrote from line {} to line{} of file {} with contents of register {}.".format(line_start, line_end, filename, label)
+
+    if queued(update, context, transactions.Edit("replace", filename,
+            line_start, line_end, content, message)):
+        return
+
+    # Replaces the lines with the register. If line_start is past the end of
+    # the file the register is appended.
+    try:
+        editor.replace(filename, line_start, line_end, content)
+    except syntax.SyntaxCheckError as e:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="Nothing written. {}".format(e),
+            disable_notification=True)
+        return
+    except:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="-1",
+            disable_notification=True)
+        return
+
+    utils.git_commit(message, [filename])
+    return
+
+# Called with: /trim <file> <line_start> [line_end]
+def trim_lines_from_file(update, context):
+    filename, line_start, line_end = context.args
+
+    message = "Deleted from line {} to line {} of file {}.".format(line_start, line_end, filename)
+
+    if queued(update, context, transactions.Edit("delete", filename,
+            line_start, line_end, None, message)):
+        return
+
+    # Line trimming.
+    try:
+        editor.delete(filename, line_start, line_end)
+    except syntax.SyntaxCheckError as e:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="Nothing written. {}".format(e),
+            disable_notification=True)
+        return
+    except:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="-1",
+            disable_notification=True)
+        return
+    utils.git_commit(message, [filename])
+    return
+
+# Called with: /sub [-i] <pattern> <replacement> <file>, and then /sub apply
+# The first form only shows the lines that would change. /sub apply edits the
+# file, unless those lines changed in the meantime.
+def substitute_in_file(update, context):
+    user_id = update.effective_user.id
+
+    if context.args == ["apply"]:
+        preview = search.previews.pop(user_id, None)
+        if preview is None:
+            context.bot.send_message(chat_id=update.effective_chat.id,
+                text="Nothing to apply.",
+                disable_notification=True)
+            return
+        apply_substitution(update, context, preview)
+        return
+
+    # Input curation.
+    args = list(context.args)
+    ignore_case = args[:1] == ["-i"]
+    if ignore_case:
+        args.pop(0)
+    if len(args) != 3:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="Correct format: " + commands.usage(SUB),
+            disable_notification=True)
+        return
+    pattern, replacement, filename = args
+
+    try:
+        preview = search.substitute(pattern, replacement, filename,
+            ignore_case)
+    except re.error as e:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="Invalid pattern: {}".format(e),
+            disable_notification=True)
+        return
+    except:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="-1",
+            disable_notification=True)
+        return
+    if not preview.changes:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="No matches.",
+            disable_notification=True)
+        return
+
+    search.previews[user_id] = preview
+    lines = []
+    for change in preview.changes:
+        lines.append("-{} {}".format(change.line, change.old))
+        lines.append("+{} {}".format(change.line, change.new))
+    lines.append("{} lines. Apply with /sub apply.".format(
+        len(preview.changes)))
+    output.send_pages(update, context, output.paginate(lines))
+
+def apply_substitution(update, context, preview):
+    message = "Substituted {} with {} in {} lines of file {}.".format(
+        preview.pattern, preview.replacement, len(preview.changes),
+        preview.filename)
+
+    # Inside a transaction every changed line is queued as a substitution,
+    # which checks at /commit that the line is still the one previewed.
+    if transactions.active(update.effective_user.id):
+        for change in preview.changes:
+            transactions.queue(update.effective_user.id, transactions.Edit(
+                "substitute", preview.filename, change.line, change.line,
+                change.new, "Substituted {} with {} in line {} of file {}."
+                .format(preview.pattern, preview.replacement, change.line,
+                    preview.filename), change.old))
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="Queued.",
+            disable_notification=True)
+        return
+
+    try:
+        search.apply(preview)
+    except ValueError as e:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="Nothing applied. {}".format(e),
+            disable_notification=True)
+        return
+    except:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="-1",
+            disable_notification=True)
+        return
+
+    utils.git_commit(message, [preview.filename])
+    context.bot.send_message(chat_id=update.effective_chat.id,
+        text="Changed {} lines.".format(len(preview.changes)),
+        disable_notification=True)
+
+###
+# Transaction functions. Edits between /begin and /commit are applied together,
+# against the line numbers the files had at /begin, in a single commit.
+###
+
+# Called with: /begin
+def transaction_begin(update, context):
+    if not transactions.begin(update.effective_user.id):
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="Transaction already open.",
+            disable_notification=True)
+
+# Called with: /commit
+def transaction_commit(update, context):
+    if not transactions.active(update.effective_user.id):
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="No transaction open.",
+            disable_notification=True)
+        return
+
+    try:
+        count = transactions.commit(update.effective_user.id)
+    except transactions.TransactionError as e:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="Nothing applied. {}".format(e),
+            disable_notification=True)
+        return
+    except:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="-1",
+            disable_notification=True)
+        return
+
+    context.bot.send_message(chat_id=update.effective_chat.id,
+        text="Applied {} edits.".format(count),
+        disable_notification=True)
+
+# Called with: /abort
+def transaction_abort(update, context):
+    if transactions.abort(update.effective_user.id) is None:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="No transaction open.",
+            disable_notification=True)
+
+###
+# History functions. Every edit is committed to git, so files can be taken back
+# to any earlier commit.
+###
+
+# Called with: /log [file] [count]
+def show_history(update, context):
+    # Input curation. Both arguments are optional; a number at the end is the
+    # count, which can't be below 1.
+    args = list(context.args)
+    count = 10
+    filename = None
+    try:
+        if args and args[-1].lstrip("+-").isdigit():
+            count = commands.positive(args.pop())
+        if len(args) > 1:
+            raise ValueError(args)
+        if args:
+            filename = args[0]
+    except ValueError:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="Correct format: " + commands.usage(LOG),
+            disable_notification=True)
+        return
+
+    try:
+        commits = history.recent(count, filename)
+    except:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="-1",
+            disable_notification=True)
+        return
+    if not commits:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="No commits.",
+            disable_notification=True)
+        return
+
+    lines = ("{} {} {}".format(c.sha[:7],
+        time.strftime("%Y-%m-%d %H:%M", time.localtime(c.time)), c.subject)
+        for c in commits)
+    output.send_pages(update, context, output.paginate(lines))
+
+# Called with: /revert <commit> [file]
+def revert_to_commit(update, context):
+    prefix, filename = context.args
+
+    try:
+        commit = history.find(prefix)
+        history.revert(commit, filename)
+    except:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="-1",
+            disable_notification=True)
+        return
+
+    context.bot.send_message(chat_id=update.effective_chat.id,
+        text="Reverted {} to {}.".format(filename or "all files",
+            commit.sha[:7]),
+        disable_notification=True)
+
+###
+# Plugins. The commands and triggers declared by the modules in plugins/ (see
+# plugins.py). Only the updates a plugin handles get here.
+###
+
+def plugin_functions(update, context):
+    if utils.must_release_rom(rom, update, context):
+        return
+
+    plugins.call(update, context)
+
+#-----------#
+# Handlers. #
+#-----------#
+
+# The command registry. CommandHandlers, /help and argument parsing come from
+# here, so a command only needs to be added to this list.
+arg = commands.arg
+
+LS = commands.command("ls", explore_directory, None,
+    "[-l] [-R] [dir] [pattern]",
+    "Checks directories. Only entries matching the glob pattern are listed; "
+    "-l adds sizes and dates, -R lists recursively.")
+LOG = commands.command("log", show_history, None, "[file] [count]",
+    "Lists the latest commits, only those touching file if given.")
+GREP = commands.command("grep", search_files, None,
+    "[-i] [-C <lines>] <pattern> <file> [file ...]",
+    "Lists the lines matching the regular expression pattern, with their "
+    "numbers. Directories are searched recursively; -i ignores case and -C "
+    "adds lines of context around each match.")
+SUB = commands.command("sub", substitute_in_file, None,
+    "[-i] <pattern> <replacement> <file>",
+    "Shows the lines of file where pattern would be replaced (\\1 refers to "
+    "a group), without editing it. /sub apply then makes the edit, unless "
+    "those lines changed since.")
+
+REGISTRY = [
+    commands.command("ping", ping, description="Replies with \"Pong.\"",
+        public=True, writing=True),
+    commands.command("help", help, description="Displays help message.",
+        public=True, writing=True),
+    commands.command("in", register_request, [arg("label")],
+        description="Activates a register for the user. The following "
+        "messages from the user will be stored inside the register until the "
+        "register is released with /ni."),
+    commands.command("ni", register_release,
+        description="Releases the active register for the user.",
+        writing=True),
+    commands.command("regs", registry_show,
+        description="Lists all non-empty registers of the user, with their "
+        "sizes and the memory they take up."),
+    commands.command("print", register_print, [arg("label")],
+        description="Shows the content of a register."),
+    commands.command("clear", register_clear, [arg("label")],
+        description="Clears register."),
+    commands.command("clear_all", rom_clear,
+        description="Clears registry containing all registers for the user."),
+    LS,
+    commands.command("read", read_lines_from_file, [arg("file"),
+            arg("line_start", int, 1),
+            arg("line_end", int, lambda a: a["line_start"] + 5)],
+        description="Reads from line_start (1 by default) to line_end (5 "
+        "lines after line_start by default) from file."),
+    GREP,
+    commands.command("get", send_file, [arg("file"),
+            arg("line_start", int, None),
+            arg("line_end", int, lambda a: a["line_start"])],
+        description="Sends file, or its lines from line_start to line_end "
+        "(line_start by default), as a document."),
+    commands.command("new", dump_to_new_file, [arg("label"), arg("file")],
+        description="Writes the contents of a register into a new file."),
+    commands.command("inject", inject_into_existing_file, [arg("label"),
+            arg("file"), arg("line", int, 1)],
+        description="Writes the contents of a register at a line in file."),
+    commands.command("overwrite", overwrite_lines_in_file, [arg("label"),
+            arg("file"), arg("line_start", int),
+            arg("line_end", int, lambda a: a["line_start"])],
+        description="Overwrites from line_start to line_end of file with the "
+        "contents of a register."),
+    commands.command("trim", trim_lines_from_file, [arg("file"),
+            arg("line_start", int),
+            arg("line_end", int, lambda a: a["line_start"])],
+        description="Deletes from line_start to line_end in file."),
+    SUB,
+    commands.command("begin", transaction_begin,
+        description="Starts a transaction. Until /commit, /new, /inject, "
+        "/overwrite and /trim are queued instead of applied."),
+    commands.command("commit", transaction_commit,
+        description="Applies the queued edits against the line numbers the "
+        "files had at /begin, all in one commit. If any of them fails, none "
+        "is applied."),
+    commands.command("abort", transaction_abort,
+        description="Drops the queued edits."),
+    commands.command("stats", show_stats,
+        description="Shows how long commands and their steps take (p50, p95, "
+        "p99)."),
+    LOG,
+    commands.command("revert", revert_to_commit, [arg("commit"),
+            arg("file", default=None)],
+        description="Reverts file, or every file if none is given, to how it "
+        "was after commit."),
+    commands.command("restart", restart_bot,
+        [arg("mode", commands.choice("full"), None)], "[full]",
+        "Reloads the bot's code without stopping it. With \"full\", "
+        "restarts the whole process, which is needed after editing the "
+        "modules that hold the running bot (the reload lists them)."),
+]
+
+# Called by bot.py at startup and by reloader.py after a reload.
+def register(dispatcher):
+    global HELP
+
+    guard_handler = TypeHandler(Update, guard)
+    dispatcher.add_handler(guard_handler, -1)
+
+    for command in REGISTRY:
+        check = None if command.writing else register_released
+        dispatcher.add_handler(
+            CommandHandler(command.name, commands.handler(command, check)))
+
+    page_handler = CallbackQueryHandler(output.next_page, pattern="^page:")
+    dispatcher.add_handler(page_handler)
+
+    register_insert_handler = MessageHandler(Filters.text, register_insert)
+    dispatcher.add_handler(register_insert_handler)
+    register_document_handler = MessageHandler(Filters.document,
+        register_document)
+    dispatcher.add_handler(register_document_handler)
+
+    dispatcher.add_error_handler(callback)
+
+    plugin_handler = plugins.PluginHandler(plugin_functions)
+    dispatcher.add_handler(plugin_handler, 1)
+
+    PUBLIC_COMMANDS.clear()
+    PUBLIC_COMMANDS.update(c.name for c in REGISTRY if c.public)
+    HELP = commands.render_help(REGISTRY)
+
+    # Timed first, so that in asyncio mode the time is the handler's and not
+    # the scheduling's.
+    stats.wrap_handlers(dispatcher)
+    if settings.ASYNC_DISPATCH:
+        aio.wrap_handlers(dispatcher)
@@ -0,0 +1,27 @@
+import os
+import threading
+import time
+
+###
+# The bot's side of supervisor.py. Messages go through the pipe in
+# SUPERVISOR_FD: "ready" once the bot is polling, then "beat" every interval
+# seconds while it's healthy.
+###
+
+def notify(message):
+    fd = os.environ.get("SUPERVISOR_FD")
+    if fd is not None:
+        os.write(int(fd), message.encode() + b'\n')
+
+# Called once the bot is polling. healthy() is checked before every beat.
+def notify_ready(healthy, interval):
+    if "SUPERVISOR_FD" not in os.environ:
+        return
+    notify("ready")
+
+    def beat():
+        while True:
+            time.sleep(interval)
+            if healthy():
+                notify("beat")
+    threading.Thread(target=beat, name="heartbeat", daemon=True).start()
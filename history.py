@@ -0,0 +1,131 @@
+from collections import namedtuple
+import os
+import subprocess as subproc
+import threading
+
+import committer
+import editor
+import stats
+
+###
+# Commit history for /log and /revert. The commits are indexed once and the
+# index is only extended with the commits made since, so a request doesn't
+# run a full git log. HEAD is read straight from .git, so an unchanged
+# history costs no git process at all.
+###
+
+# Commits kept in the index, newest first.
+KEPT = 5000
+
+Commit = namedtuple("Commit", ["sha", "time", "subject", "files"])
+
+# Kept across reloads (see reloader.py).
+try:
+    commits
+except NameError:
+    commits = []
+    head = None
+    lock = threading.Lock()
+
+@stats.timed("git")
+def git(*args):
+    return subproc.check_output(["git"] + list(args), cwd=committer.REPO,
+        encoding="UTF-8")
+
+# Falls back to git when HEAD points to a packed ref or isn't a branch.
+def read_head():
+    git_dir = os.path.join(committer.REPO, ".git")
+    try:
+        with open(os.path.join(git_dir, "HEAD"), 'r') as f:
+            ref = f.read().strip()
+        if ref.startswith("ref: "):
+            with open(os.path.join(git_dir, ref[5:]), 'r') as f:
+                return f.read().strip()
+    except OSError:
+        pass
+    return git("rev-parse", "HEAD").strip()
+
+def parse_log(out):
+    parsed = []
+    for record in out.split('\0')[1:]:
+        header, _, files = record.partition('\n')
+        sha, time, subject = header.split('\x1f', 2)
+        parsed.append(Commit(sha, int(time), subject,
+            tuple(f for f in files.split('\n') if f)))
+    return parsed
+
+def log(*args):
+    return parse_log(git("log", "--format=%x00%H%x1f%ct%x1f%s", "--name-only",
+        *args))
+
+# Brings the index up to date with HEAD. Queued edits are committed first.
+def refresh():
+    global commits, head
+    committer.flush()
+    with lock:
+        current = read_head()
+        if current == head:
+            return
+        if (
+                head is not None
+                and subproc.run(["git", "merge-base", "--is-ancestor", head,
+                    current], cwd=committer.REPO).returncode == 0
+        ):
+            commits = (log("{}..{}".format(head, current)) + commits)[:KEPT]
+        else:
+            # First use, or the history was rewritten.
+            commits = log("-n", str(KEPT), current)
+        head = current
+
+# Commits touching filename (any commit if None), newest first.
+def recent(count, filename=None):
+    refresh()
+    if filename is None:
+        return commits[:count]
+    paths = committer.repo_paths([filename])
+    if not paths:
+        return []
+    return [c for c in commits if paths[0] in c.files][:count]
+
+# The commit of the index whose sha starts with prefix.
+def find(prefix):
+    refresh()
+    found = [c for c in commits if c.sha.startswith(prefix)]
+    if len(found) != 1:
+        raise ValueError("No single commit starts with {}.".format(prefix))
+    return found[0]
+
+# Restores filename, or the whole tree if None, to how it was after commit.
+# The restore is committed like any other edit.
+def revert(commit, filename=None):
+    refresh()
+    if filename is None:
+        # The files that differ between commit and HEAD, and the tracked files
+        # edited since HEAD. Files that are only staged, and aren't the bot's,
+        # are left alone.
+        changed = set(git("diff", "--name-only", "-z", commit.sha, "HEAD")
+            .split('\0'))
+        changed |= set(git("diff", "--name-only", "-z", "--diff-filter=a",
+            "HEAD").split('\0'))
+        changed = sorted(p for p in changed if p)
+        if not changed:
+            return
+        paths = [os.path.join(committer.REPO, p) for p in changed]
+        with editor.locked(paths):
+            git("restore", "--source", commit.sha, "--staged", "--worktree",
+                "--", *changed)
+        committer.queue_commit(
+            "Reverted to {} ({}).".format(commit.sha[:7], commit.subject),
+            paths)
+        return
+
+    paths = committer.repo_paths([filename])
+    if not paths:
+        raise ValueError("{} isn't in the repository.".format(filename))
+    with editor.locked([filename]):
+        git("restore", "--source", commit.sha, "--staged", "--worktree", "--",
+            paths[0])
+    committer.queue_commit(
+        "Reverted {} to {} ({}).".format(filename, commit.sha[:7],
+            commit.subject),
+        [filename])
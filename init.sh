@@ -1,9 +1,5 @@
 #!/bin/sh
 cd ${0%/*}
 
-while true
-do
-	python bot.py
-	wait $!
-done
-
+# The supervisor restarts the bot, see supervisor.py.
+exec python supervisor.py
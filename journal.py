@@ -0,0 +1,169 @@
+import logging
+import os
+import pickle
+import shutil
+import threading
+
+from registers import as_register
+import settings
+import stats
+import utils
+
+###
+# Register journal. Every mutation of the rom appends one record to
+# rom.journal instead of pickling the whole rom again. Once the journal grows
+# past settings.JOURNAL_COMPACT_RECORDS a background thread writes a fresh
+# rom.pickle and the journal starts over.
+#
+# Records: ("set", user_id, label, string), ("del", user_id, label),
+# ("clear", user_id). Replaying a record twice gives the same rom, so a
+# compaction that died halfway is harmless.
+###
+
+JOURNAL = "rom.journal"
+# The journal being folded into rom.pickle. Only exists during a compaction.
+COMPACTING = "rom.journal.compacting"
+
+logger = logging.getLogger(__name__)
+
+lock = threading.Lock()
+journal = None
+records = 0
+compactor = None
+
+# Replaces the pickle.load of rom.pickle at startup.
+def load():
+    global journal, records
+    try:
+        with open(utils.ROM, "rb") as f:
+            rom = pickle.load(f)
+    except:
+        rom = {}
+    for user_id in rom.keys():
+        registers = rom[user_id][1]
+        for label in registers.keys():
+            registers[label] = as_register(registers[label])
+
+    if os.path.exists(COMPACTING):
+        replay(rom, COMPACTING)
+    records = replay(rom, JOURNAL)
+    journal = open(JOURNAL, "ab")
+    return rom
+
+def replay(rom, filename):
+    count = 0
+    good = 0
+    try:
+        f = open(filename, "r+b")
+    except FileNotFoundError:
+        return 0
+    with f:
+        while True:
+            try:
+                record = pickle.load(f)
+            except EOFError:
+                break
+            except:
+                # A torn record from a crash. Everything after it is dropped so
+                # new records aren't appended after garbage.
+                logger.warning("Truncating %s at byte %d.", filename, good)
+                f.truncate(good)
+                break
+            apply(rom, record)
+            good = f.tell()
+            count += 1
+    return count
+
+def apply(rom, record):
+    if record[0] == "set":
+        _, user_id, label, string = record
+        registers = rom.setdefault(user_id, [None, {}])[1]
+        if label in registers.keys():
+            registers[label].discard()
+        registers[label] = as_register(string)
+    elif record[0] == "del":
+        _, user_id, label = record
+        if user_id in rom.keys() and label in rom[user_id][1].keys():
+            rom[user_id][1].pop(label).discard()
+    elif record[0] == "clear":
+        _, user_id = record
+        for register in rom.pop(user_id, [None, {}])[1].values():
+            register.discard()
+
+@stats.timed("journal write")
+def write(rom, record):
+    global records
+    data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+    with lock:
+        journal.write(data)
+        journal.flush()
+        os.fsync(journal.fileno())
+        records += 1
+        if records >= settings.JOURNAL_COMPACT_RECORDS:
+            start_compaction(rom)
+
+# Mutations. The rom itself is already up to date when these are called.
+
+def set_register(rom, user_id, label):
+    write(rom, ("set", user_id, label, rom[user_id][1][label].text()))
+
+def delete_register(rom, user_id, label):
+    write(rom, ("del", user_id, label))
+
+def clear_registry(rom, user_id):
+    write(rom, ("clear", user_id))
+
+###
+# Compaction.
+###
+
+# Active labels aren't persisted, and registers go to disk as plain strings so
+# that rom.pickle stays readable without registers.py. Taking the text now
+# keeps later messages out of the snapshot. Registers sharing a blob get the
+# very same string, which pickle writes only once.
+def snapshot_of(rom):
+    snapshot = {}
+    texts = {}
+    for user_id, (_, registers) in list(rom.items()):
+        snapshot[user_id] = [None, {}]
+        for label, r in list(registers.items()):
+            digest = r.digest
+            if digest is None:
+                snapshot[user_id][1][label] = r.text()
+                continue
+            if digest not in texts:
+                texts[digest] = r.text()
+            snapshot[user_id][1][label] = texts[digest]
+    return snapshot
+
+# Called with the lock held. The snapshot and the journal switch happen
+# together, so the snapshot holds exactly the records of the old journal.
+def start_compaction(rom):
+    global journal, records, compactor
+    if compactor is not None and compactor.is_alive():
+        return
+
+    snapshot = snapshot_of(rom)
+
+    journal.close()
+    if os.path.exists(COMPACTING):
+        # A previous compaction failed. Its records are kept until a snapshot
+        # makes it to disk.
+        with open(COMPACTING, "ab") as old, open(JOURNAL, "rb") as new:
+            shutil.copyfileobj(new, old)
+        os.remove(JOURNAL)
+    else:
+        os.replace(JOURNAL, COMPACTING)
+    journal = open(JOURNAL, "ab")
+    records = 0
+
+    compactor = threading.Thread(target=compact, args=(snapshot,),
+        name="journal-compactor", daemon=True)
+    compactor.start()
+
+def compact(snapshot):
+    try:
+        utils.save_rom(snapshot)
+        os.remove(COMPACTING)
+    except:
+        logger.exception("Journal compaction failed.")
@@ -0,0 +1,132 @@
+from array import array
+from collections import OrderedDict
+import os
+import threading
+
+import stats
+
+###
+# Line index. Reading lines from a large file shouldn't mean scanning it from
+# the start every time, so the byte offset of every STRIDE-th line is kept per
+# file. A read seeks to the closest offset and skips at most STRIDE - 1 lines.
+#
+# Indexes are keyed on the path and checked against the file's inode, size and
+# mtime. A file that only grew is indexed from where the old index ended.
+###
+
+STRIDE = 64
+# Bytes before the old end of the file compared to tell an append apart from
+# a rewrite.
+SAMPLE = 64
+BLOCK = 1 << 20
+CACHED_FILES = 32
+
+class Index:
+    def __init__(self, stat):
+        self.ino = stat.st_ino
+        self.mtime = stat.st_mtime_ns
+        self.size = 0
+        # offsets[k] is where line k * STRIDE + 1 starts.
+        self.offsets = array('Q', [0])
+        # Newlines seen so far.
+        self.newlines = 0
+        self.sample = b""
+
+    # Indexes the file from self.size up to its current end.
+    def extend(self, f, stat):
+        f.seek(self.size)
+        position = self.size
+        while True:
+            block = f.read(BLOCK)
+            if not block:
+                break
+            i = block.find(b'\n')
+            while i != -1:
+                self.newlines += 1
+                if self.newlines % STRIDE == 0:
+                    self.offsets.append(position + i + 1)
+                i = block.find(b'\n', i + 1)
+            position += len(block)
+
+        self.size = position
+        self.mtime = stat.st_mtime_ns
+        f.seek(max(0, position - SAMPLE))
+        self.sample = f.read(SAMPLE)
+
+    def appended_to(self, f, stat):
+        if stat.st_ino != self.ino or stat.st_size <= self.size:
+            return False
+        f.seek(max(0, self.size - SAMPLE))
+        return f.read(len(self.sample)) == self.sample
+
+# Kept across reloads (see reloader.py).
+try:
+    cache
+except NameError:
+    cache = OrderedDict()
+    lock = threading.Lock()
+
+def get_index(f, path):
+    stat = os.fstat(f.fileno())
+    with lock:
+        index = cache.get(path)
+        if index is not None:
+            cache.move_to_end(path)
+    if (
+            index is not None
+            and index.ino == stat.st_ino
+            and index.size == stat.st_size
+            and index.mtime == stat.st_mtime_ns
+    ):
+        return index
+
+    if index is None or not index.appended_to(f, stat):
+        index = Index(stat)
+    index.extend(f, stat)
+
+    with lock:
+        cache[path] = index
+        cache.move_to_end(path)
+        while len(cache) > CACHED_FILES:
+            cache.popitem(last=False)
+    return index
+
+# Returns the lines from line_start to line_end (both included, starting at 1)
+# without their newlines.
+@stats.timed("file index read")
+def read_lines(filename, line_start, line_end):
+    if line_start < 1:
+        raise ValueError("Invalid line {}.".format(line_start))
+    path = os.path.abspath(filename)
+    with open(path, "rb") as f:
+        index = get_index(f, path)
+
+        k = min((line_start - 1) // STRIDE, len(index.offsets) - 1)
+        f.seek(index.offsets[k])
+        for _ in range(line_start - 1 - k * STRIDE):
+            if not f.readline():
+                return []
+
+        lines = []
+        for _ in range(line_end - line_start + 1):
+            line = f.readline()
+            if not line:
+                break
+            lines.append(line.rstrip(b'\n').decode("UTF-8", "replace"))
+        return lines
+
+# Like read_lines, but lazy: lines are read batch lines at a time while the
+# result is consumed. The first batch is read right away so errors show up on
+# the call.
+def iter_lines(filename, line_start, line_end, batch=256):
+    first = read_lines(filename, line_start, min(line_end, line_start + batch - 1))
+    return chain_batches(filename, first, line_start, line_end, batch)
+
+def chain_batches(filename, lines, line_start, line_end, batch):
+    while lines:
+        yield from lines
+        line_start += len(lines)
+        if line_start > line_end or len(lines) < batch:
+            return
+        lines = read_lines(filename, line_start,
+            min(line_end, line_start + batch - 1))
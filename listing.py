@@ -0,0 +1,112 @@
+from collections import namedtuple, OrderedDict
+import fnmatch
+import os
+import threading
+import time
+
+import settings
+import stats
+
+###
+# Directory listing for /ls. Directories are read with os.scandir and the
+# sorted entries are kept for settings.LS_CACHE_TTL seconds, as long as the
+# directory's mtime stays the same. Recursive listings aren't cached: they're
+# produced as they're walked, so the first page goes out before the walk ends.
+# Like os.walk, they don't descend into links to directories, which could lead
+# back up the tree or out of it.
+###
+
+CACHED_DIRECTORIES = 64
+
+Entry = namedtuple("Entry", ["name", "is_dir", "size", "mtime", "is_link"])
+
+# Kept across reloads (see reloader.py).
+try:
+    cache
+except NameError:
+    # cache = {(path, long): (mtime, expiry, [(Entry, line)])}
+    cache = OrderedDict()
+    lock = threading.Lock()
+
+# Sizes and mtimes cost a stat per entry, so they're only read when long.
+@stats.timed("directory scan")
+def scan(path, long=False):
+    entries = []
+    with os.scandir(path) as it:
+        for e in it:
+            # Like ls, hidden files aren't listed.
+            if e.name.startswith('.'):
+                continue
+            try:
+                is_dir = e.is_dir()
+                is_link = e.is_symlink()
+                if long:
+                    stat = e.stat()
+                    entries.append(Entry(e.name, is_dir, stat.st_size,
+                        stat.st_mtime, is_link))
+                else:
+                    entries.append(Entry(e.name, is_dir, 0, 0, is_link))
+            except OSError:
+                # Files removed while listing, and broken links.
+                entries.append(Entry(e.name, False, 0, 0, False))
+    entries.sort(key=lambda e: e.name)
+    return entries
+
+def format_entry(entry, long, prefix=""):
+    name = prefix + entry.name + ('/' if entry.is_dir else "")
+    if not long:
+        return name
+    return "{:>10} {} {}".format(entry.size,
+        time.strftime("%Y-%m-%d %H:%M", time.localtime(entry.mtime)), name)
+
+# Returns [(Entry, line)] for a directory, from the cache if possible.
+def entries(path, long):
+    path = os.path.abspath(path)
+    mtime = os.stat(path).st_mtime_ns
+    now = time.monotonic()
+    with lock:
+        cached = cache.get((path, long))
+        if cached is not None and cached[0] == mtime and cached[1] > now:
+            cache.move_to_end((path, long))
+            return cached[2]
+
+    result = [(e, format_entry(e, long)) for e in scan(path, long)]
+    with lock:
+        cache[(path, long)] = (mtime, now + settings.LS_CACHE_TTL, result)
+        cache.move_to_end((path, long))
+        while len(cache) > CACHED_DIRECTORIES:
+            cache.popitem(last=False)
+    return result
+
+def matches(entry, pattern):
+    return pattern is None or fnmatch.fnmatch(entry.name, pattern)
+
+# Returns the lines for a directory (or a single file, like ls).
+def list_directory(path, pattern=None, long=False):
+    if not os.path.isdir(path):
+        stat = os.stat(path)
+        entry = Entry(os.path.basename(path), False, stat.st_size,
+            stat.st_mtime, False)
+        return [format_entry(entry, long)]
+    if pattern is None:
+        return [line for _, line in entries(path, long)]
+    return [line for e, line in entries(path, long) if matches(e, pattern)]
+
+# Yields the lines for a directory and everything under it, paths relative to
+# it. The top directory is scanned right away so errors show up on the call.
+def walk(path, pattern=None, long=False):
+    top = scan(path, long)
+    return walk_entries(path, top, "", pattern, long)
+
+def walk_entries(path, listed, prefix, pattern, long):
+    for e in listed:
+        if matches(e, pattern):
+            yield format_entry(e, long, prefix)
+        if e.is_dir and not e.is_link:
+            child = os.path.join(path, e.name)
+            try:
+                below = scan(child, long)
+            except OSError:
+                continue
+            yield from walk_entries(child, below, prefix + e.name + '/',
+                pattern, long)
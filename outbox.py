@@ -0,0 +1,193 @@
+from collections import deque, namedtuple, OrderedDict
+import logging
+import threading
+import time
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, Unauthorized
+
+import settings
+import stats
+
+###
+# Outbound messages. Handlers don't wait for Telegram when they send a message:
+# the message is queued per chat and a few sender threads deliver the queues,
+# at most settings.SEND_RATE messages a second in total and
+# settings.SEND_CHAT_RATE per chat. Consecutive short messages waiting for the
+# same chat go out as one. A 429 from Telegram holds the chat back for as long
+# as it asks; network errors are retried with backoff. Messages Telegram
+# refuses (too long, chat not found, bot blocked) are logged and dropped.
+###
+
+logger = logging.getLogger(__name__)
+
+# Messages up to this length can be merged, as long as the result fits in one
+# Telegram message.
+SHORT = 1024
+LIMIT = 4096
+
+# queued is the time the handler sent it, attempts the failed sends so far.
+Message = namedtuple("Message", ["chat_id", "text", "kwargs", "queued",
+    "attempts"])
+
+# chats = {chat_id: deque of Message}, in the order they're served.
+chats = OrderedDict()
+# The time before which nothing more goes to a chat, and to any chat.
+ready_at = {}
+next_send = 0.0
+# Chats with a send in progress, so their messages stay in order.
+busy = set()
+condition = threading.Condition()
+senders = []
+
+def depth():
+    with condition:
+        return sum(len(q) for q in chats.values())
+
+stats.gauge("outbox queued messages", depth)
+
+def start():
+    if senders:
+        return
+    for i in range(settings.SEND_WORKERS):
+        thread = threading.Thread(target=work, name="outbox-{}".format(i),
+            daemon=True)
+        thread.start()
+        senders.append(thread)
+
+def queue_message(chat_id, text, kwargs):
+    with condition:
+        chats.setdefault(chat_id, deque()).append(
+            Message(chat_id, text, kwargs, time.monotonic(), 0))
+        condition.notify()
+
+# Waits until every queued message is sent, or timeout seconds pass. Returns
+# True if nothing is left.
+def flush(timeout=None):
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with condition:
+        while chats or busy:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            condition.wait(remaining)
+        return True
+
+def mergeable(message):
+    return (
+        len(message.text) <= SHORT
+        and message.kwargs.get("reply_markup") is None
+    )
+
+# Takes the next message of a chat, merged with the short ones after it.
+def take(queue):
+    message = queue.popleft()
+    if not mergeable(message):
+        return message
+    texts = [message.text]
+    size = len(message.text)
+    while (
+            queue
+            and mergeable(queue[0])
+            and queue[0].kwargs == message.kwargs
+            and size + 1 + len(queue[0].text) <= LIMIT
+    ):
+        following = queue.popleft()
+        texts.append(following.text)
+        size += 1 + len(following.text)
+    return message._replace(text='\n'.join(texts))
+
+# Returns the next message that can be sent now, or how long to wait for one.
+def next_message(now):
+    global next_send
+    if next_send > now:
+        return None, next_send - now
+    wait = None
+    for chat_id, queue in chats.items():
+        if chat_id in busy:
+            continue
+        ready = ready_at.get(chat_id, 0.0)
+        if ready > now:
+            wait = ready - now if wait is None else min(wait, ready - now)
+            continue
+        message = take(queue)
+        if not queue:
+            del chats[chat_id]
+        else:
+            chats.move_to_end(chat_id)
+        busy.add(chat_id)
+        ready_at[chat_id] = now + 1 / settings.SEND_CHAT_RATE
+        next_send = now + 1 / settings.SEND_RATE
+        return message, None
+    return None, wait
+
+def work():
+    while True:
+        with condition:
+            while True:
+                message, wait = next_message(time.monotonic())
+                if message is not None:
+                    break
+                condition.wait(wait)
+        send(message)
+        with condition:
+            busy.discard(message.chat_id)
+            condition.notify_all()
+
+def send(message):
+    try:
+        bot.send_message(chat_id=message.chat_id, text=message.text,
+            **message.kwargs)
+    except RetryAfter as e:
+        logger.warning("Flood limit on %s, retrying in %s s.",
+            message.chat_id, e.retry_after)
+        retry(message, e.retry_after)
+        return
+    # BadRequest is a NetworkError too, but sending it again won't help.
+    except (BadRequest, Unauthorized):
+        logger.exception("Telegram refused a message to %s.", message.chat_id)
+        return
+    except NetworkError:
+        attempts = message.attempts + 1
+        if attempts >= settings.SEND_ATTEMPTS:
+            logger.exception("Couldn't send message to %s.", message.chat_id)
+            return
+        retry(message._replace(attempts=attempts),
+            min(settings.SEND_BACKOFF[0] * 2 ** (attempts - 1),
+                settings.SEND_BACKOFF[1]))
+        return
+    except Exception:
+        logger.exception("Couldn't send message to %s.", message.chat_id)
+        return
+    stats.record("outbox latency", time.monotonic() - message.queued)
+
+# Puts the message back in front of its chat's queue.
+def retry(message, delay):
+    with condition:
+        chats.setdefault(message.chat_id, deque()).appendleft(message)
+        chats.move_to_end(message.chat_id, last=False)
+        ready_at[message.chat_id] = time.monotonic() + delay
+
+###
+# Handlers get a bot whose send_message queues. Everything else goes straight
+# to the real bot.
+###
+
+bot = None
+
+class QueuedBot:
+    def __init__(self, bot):
+        self._bot = bot
+
+    def __getattr__(self, name):
+        return getattr(self._bot, name)
+
+    # Returns nothing: the message is sent later.
+    def send_message(self, chat_id, text, **kwargs):
+        queue_message(chat_id, text, kwargs)
+
+# Called once by bot.py, which puts the returned bot on the dispatcher.
+def wrap_bot(real_bot):
+    global bot
+    bot = real_bot
+    start()
+    return QueuedBot(real_bot)
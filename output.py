@@ -0,0 +1,103 @@
+from collections import OrderedDict
+import secrets
+import threading
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+import settings
+
+###
+# Output. Telegram rejects messages longer than LIMIT characters, so long
+# outputs are split on line boundaries into pages. Pages are produced by a
+# generator: they're either sent in one go, or sent one at a time with a
+# "Next" button, in which case the generator is kept and resumed when the
+# button is pressed. Sent in one go, an output stops at
+# settings.OUTPUT_EAGER_PAGES pages and the rest comes with the "Next" button,
+# so that a huge output can't hold the chat's outbox (see outbox.py) for hours.
+###
+
+LIMIT = 4096
+# Paginations waiting for their "Next" button. The oldest are dropped.
+KEPT_CURSORS = 256
+
+# Kept across reloads (see reloader.py).
+try:
+    cursors
+except NameError:
+    # cursors = {token: (chat_id, page, pages)}
+    cursors = OrderedDict()
+    lock = threading.Lock()
+
+# Joins items with sep into pages of at most limit characters. Items longer
+# than a page are cut.
+def paginate(items, sep='\n', limit=LIMIT):
+    page = []
+    size = 0
+    for item in items:
+        while len(item) > limit:
+            if page:
+                yield sep.join(page)
+                page = []
+                size = 0
+            yield item[:limit]
+            item = item[limit:]
+        extra = len(item) + (len(sep) if page else 0)
+        if page and size + extra > limit:
+            yield sep.join(page)
+            page = []
+            size = 0
+            extra = len(item)
+        page.append(item)
+        size += extra
+    if page:
+        yield sep.join(page)
+
+def send_pages(update, context, pages):
+    chat_id = update.effective_chat.id
+    pages = (p for p in pages if p)
+    if settings.OUTPUT_PAGES:
+        send_page(context.bot, chat_id, next(pages, None), pages)
+        return
+
+    for _ in range(settings.OUTPUT_EAGER_PAGES - 1):
+        page = next(pages, None)
+        if page is None:
+            return
+        context.bot.send_message(chat_id=chat_id, text=page,
+            disable_notification=True)
+    send_page(context.bot, chat_id, next(pages, None), pages)
+
+# Sends page and, if pages isn't exhausted, a "Next" button for the one after.
+def send_page(bot, chat_id, page, pages):
+    if page is None:
+        return
+    following = next(pages, None)
+    markup = None
+    if following is not None:
+        token = secrets.token_hex(8)
+        with lock:
+            cursors[token] = (chat_id, following, pages)
+            while len(cursors) > KEPT_CURSORS:
+                cursors.popitem(last=False)
+        markup = InlineKeyboardMarkup(
+            [[InlineKeyboardButton("Next", callback_data="page:" + token)]])
+    bot.send_message(chat_id=chat_id, text=page, reply_markup=markup,
+        disable_notification=True)
+
+# Answers a press of the "Next" button.
+def next_page(update, context):
+    query = update.callback_query
+    query.answer()
+    token = query.data[len("page:"):]
+    with lock:
+        cursor = cursors.pop(token, None)
+    # The button has done its job either way.
+    query.edit_message_reply_markup(reply_markup=None)
+    if cursor is None:
+        context.bot.send_message(chat_id=update.effective_chat.id,
+            text="Pagination expired.",
+            disable_notification=True)
+        return
+
+    chat_id, page, pages = cursor
+    send_page(context.bot, chat_id, page, pages)
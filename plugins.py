@@ -0,0 +1,180 @@
+import ast
+import importlib.util
+import logging
+import os
+import re
+import threading
+import time
+
+from telegram import Update
+from telegram.ext import Handler
+
+###
+# Plugins. Every module in the PLUGINS directory declares what it handles,
+# with literals at its top level:
+#
+#     COMMANDS = {"echo": "echo"}            # /echo calls echo(update, context)
+#     TRIGGERS = {r"^good morning": "greet"} # so do messages matching it
+#
+# The declarations are read from the source without importing it, and make up
+# the routing table: a dict of commands and the compiled trigger patterns. An
+# update that matches neither costs a dict lookup or a few regex searches and
+# nothing else. A plugin is imported the first time an update is routed to
+# it, and again after its file changes, without touching the other plugins.
+# The directory is checked for changes at most every CHECK_INTERVAL seconds.
+###
+
+PLUGINS = "plugins"
+CHECK_INTERVAL = 1.0
+
+logger = logging.getLogger(__name__)
+
+class Plugin:
+    def __init__(self, name, path, mtime, commands, triggers):
+        self.name = name
+        self.path = path
+        self.mtime = mtime
+        # {command: function name}, {pattern: function name}
+        self.commands = commands
+        self.triggers = triggers
+        # Imported on first use.
+        self.module = None
+
+# Kept across reloads (see reloader.py).
+try:
+    plugins
+except NameError:
+    # plugins = {name: Plugin}
+    plugins = {}
+    # The routing table. Both are replaced, never modified, so they can be read
+    # without the lock.
+    # commands = {command: (Plugin, function name)}
+    commands = {}
+    # triggers = [(compiled pattern, Plugin, function name)]
+    triggers = []
+    checked = 0
+    lock = threading.Lock()
+
+# Returns the COMMANDS and TRIGGERS of a plugin's source.
+def declarations(source, path):
+    found = {}
+    for node in ast.parse(source, path).body:
+        if (
+                isinstance(node, ast.Assign)
+                and len(node.targets) == 1
+                and isinstance(node.targets[0], ast.Name)
+                and node.targets[0].id in ["COMMANDS", "TRIGGERS"]
+        ):
+            found[node.targets[0].id] = dict(ast.literal_eval(node.value))
+    return found.get("COMMANDS", {}), found.get("TRIGGERS", {})
+
+# A plugin that can't be read handles nothing until its file changes again.
+def scan(name, path, mtime):
+    try:
+        with open(path, 'r', encoding="UTF-8") as f:
+            found = declarations(f.read(), path)
+    except Exception:
+        logger.exception("Couldn't read the declarations of plugin %s.", name)
+        found = ({}, {})
+    return Plugin(name, path, mtime, *found)
+
+def build():
+    global commands, triggers
+    routed = {}
+    compiled = []
+    for name in sorted(plugins.keys()):
+        plugin = plugins[name]
+        for command, function in plugin.commands.items():
+            routed.setdefault(command, (plugin, function))
+        for pattern, function in plugin.triggers.items():
+            try:
+                compiled.append((re.compile(pattern), plugin, function))
+            except re.error:
+                logger.exception("Invalid trigger in plugin %s.", name)
+    commands = routed
+    triggers = compiled
+
+def refresh():
+    global checked
+    now = time.monotonic()
+    if now - checked < CHECK_INTERVAL:
+        return
+    with lock:
+        checked = now
+        try:
+            files = {f[:-3]: os.path.join(PLUGINS, f)
+                for f in os.listdir(PLUGINS)
+                if f.endswith(".py") and not f.startswith(('_', '.'))}
+        except FileNotFoundError:
+            files = {}
+
+        changed = False
+        for name in list(plugins.keys()):
+            if name not in files:
+                del plugins[name]
+                changed = True
+        for name, path in files.items():
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            plugin = plugins.get(name)
+            if plugin is not None and plugin.mtime == mtime:
+                continue
+            plugins[name] = scan(name, path, mtime)
+            changed = True
+        if changed:
+            build()
+
+# Returns (Plugin, function name, args, match) for the text of a message, or
+# None if no plugin handles it.
+def route(text):
+    refresh()
+    if text.startswith('/'):
+        words = text.split()
+        target = commands.get(words[0][1:].split('@')[0])
+        if target is None:
+            return None
+        return target + (words[1:], None)
+    for regex, plugin, function in triggers:
+        match = regex.search(text)
+        if match:
+            return plugin, function, None, match
+    return None
+
+def command_names():
+    refresh()
+    return sorted(commands.keys())
+
+def module_of(plugin):
+    with lock:
+        if plugin.module is None:
+            spec = importlib.util.spec_from_file_location(
+                PLUGINS + '.' + plugin.name, plugin.path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            plugin.module = module
+        return plugin.module
+
+# Runs the plugin function the update was routed to by PluginHandler.
+def call(update, context):
+    plugin, function = context.plugin
+    getattr(module_of(plugin), function)(update, context)
+
+# Only takes the updates the routing table has a plugin for. Commands get
+# their arguments in context.args, triggers their match in context.matches.
+class PluginHandler(Handler):
+    def check_update(self, update):
+        if not isinstance(update, Update) or update.callback_query is not None:
+            return None
+        message = update.effective_message
+        if message is None or not message.text:
+            return None
+        return route(message.text)
+
+    def collect_additional_context(self, context, update, dispatcher,
+            check_result):
+        plugin, function, args, match = check_result
+        context.plugin = (plugin, function)
+        context.args = args
+        context.matches = [match] if match else None
@@ -0,0 +1,18 @@
+###
+# Example plugin (see plugins.py). Only these declarations are read until an
+# update is routed here.
+###
+
+COMMANDS = {"echo": "echo"}
+TRIGGERS = {r"^ping\?$": "pong"}
+
+# Called with: /echo <text>
+def echo(update, context):
+    context.bot.send_message(chat_id=update.effective_chat.id,
+        text=' '.join(context.args) or "Nothing to echo.",
+        disable_notification=True)
+
+# Called with: ping?
+def pong(update, context):
+    context.bot.send_message(chat_id=update.effective_chat.id, text="Pong.",
+        disable_notification=True)
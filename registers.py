@@ -0,0 +1,83 @@
+import blobs
+
+###
+# Register buffers. A register grows one message at a time, so it's kept as a
+# list of chunks and only joined when the text is actually needed. Appending is
+# O(1) instead of copying the whole string for every message.
+#
+# Once released, a register is frozen: its text moves to the blob store (see
+# blobs.py), where identical registers share one, possibly compressed, copy.
+# Appending to a frozen register thaws it back into chunks.
+#
+# Only plain strings are written to rom.pickle and the journal; registers are
+# rebuilt from them on load.
+###
+
+class Register:
+    def __init__(self, text=""):
+        self.chunks = [text] if text else []
+        # Set while frozen.
+        self.digest = None
+
+    # Messages are separated by a newline.
+    def append(self, text):
+        if self.digest is not None:
+            self.thaw()
+        self.chunks.append(text)
+
+    def freeze(self):
+        if self.digest is None:
+            self.digest = blobs.intern(self.text())
+            self.chunks = []
+
+    def thaw(self):
+        digest = self.digest
+        self.chunks = [blobs.get(digest)]
+        self.digest = None
+        blobs.release(digest)
+
+    # Called when the register is deleted, so its blob can go.
+    def discard(self):
+        if self.digest is not None:
+            blobs.release(self.digest)
+            self.digest = None
+        self.chunks = []
+
+    # Joins the chunks and keeps the result, so asking twice is cheap. The
+    # slice assignment is atomic, a chunk appended meanwhile isn't lost.
+    def text(self):
+        if self.digest is not None:
+            return blobs.get(self.digest)
+        n = len(self.chunks)
+        if n == 0:
+            return ""
+        if n > 1:
+            self.chunks[:n] = ['\n'.join(self.chunks[:n])]
+        return self.chunks[0]
+
+    def __str__(self):
+        return self.text()
+
+    # Bytes of the text, bytes the register takes up, and whether those are
+    # shared with other registers.
+    def sizes(self):
+        if self.digest is not None:
+            return (blobs.size(self.digest), blobs.stored_size(self.digest),
+                blobs.shared(self.digest))
+        size = len(self.text().encode("UTF-8"))
+        return size, size, False
+
+    def __eq__(self, other):
+        if isinstance(other, Register):
+            other = other.text()
+        return self.text() == other
+
+    def __repr__(self):
+        return "Register({!r})".format(self.text())
+
+# Old rom.pickle files hold plain strings. Loaded registers are released ones.
+def as_register(value):
+    if not isinstance(value, Register):
+        value = Register(value)
+    value.freeze()
+    return value
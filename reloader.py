@@ -0,0 +1,55 @@
+import importlib
+import logging
+from time import perf_counter
+
+import acl
+import commands
+import documents
+import editor
+import handlers
+import history
+import lineindex
+import listing
+import output
+import plugins
+import search
+import settings
+import syntax
+import transactions
+import utils
+
+###
+# Hot reload. Imports the bot's modules again and registers the new handlers
+# on the live dispatcher, so the Updater keeps polling and the rom stays in
+# memory. The reloaded modules keep their state (caches, locks, queued
+# transactions) with the "try: name / except NameError" idiom. Modules that
+# run threads or hold objects the live bot is made of aren't reloaded: edits
+# to those in KEPT need /restart full. Plugins are reloaded by plugins.py when
+# their files change.
+###
+
+# In dependency order.
+MODULES = [settings, utils, syntax, editor, lineindex, search, listing, output,
+    acl, documents, history, transactions, plugins, commands, handlers]
+# Not reloaded, listed for the /restart help.
+KEPT = ["bot", "standby", "stats", "outbox", "aio", "webhook", "heartbeat",
+    "journal", "committer", "registers", "blobs", "reloader"]
+
+logger = logging.getLogger(__name__)
+
+# Returns the time the reload took, in seconds.
+def reload(dispatcher):
+    start = perf_counter()
+    for module in MODULES:
+        importlib.reload(module)
+
+    # New containers instead of clearing the old ones: the update that asked
+    # for the reload is still iterating over them.
+    dispatcher.handlers = {}
+    dispatcher.groups = []
+    dispatcher.error_handlers = {}
+    handlers.register(dispatcher)
+
+    elapsed = perf_counter() - start
+    logger.info("Reloaded in %.1f ms.", elapsed * 1000)
+    return elapsed
@@ -0,0 +1,231 @@
+from collections import namedtuple, OrderedDict
+import glob
+import mmap
+import os
+import re
+import threading
+
+import editor
+
+###
+# Search and replace for /grep and /sub. Files are memory-mapped and searched
+# as bytes, so a large file is never read into memory as a whole: only the
+# lines that match (and their context) are decoded. Compiled patterns are kept,
+# since the same few patterns tend to be searched again and again.
+###
+
+CACHED_PATTERNS = 64
+BLOCK = 1 << 20
+# Files with a NUL byte in their first BINARY_SAMPLE bytes aren't searched.
+BINARY_SAMPLE = 8192
+
+# Kept across reloads (see reloader.py).
+try:
+    patterns
+except NameError:
+    # patterns = {(pattern, ignore_case): compiled}
+    patterns = OrderedDict()
+    lock = threading.Lock()
+
+# Raises re.error if the pattern is invalid.
+def compile(pattern, ignore_case=False):
+    key = (pattern, ignore_case)
+    with lock:
+        regex = patterns.get(key)
+        if regex is not None:
+            patterns.move_to_end(key)
+            return regex
+
+    flags = re.MULTILINE | (re.IGNORECASE if ignore_case else 0)
+    regex = re.compile(pattern.encode("UTF-8"), flags)
+    with lock:
+        patterns[key] = regex
+        while len(patterns) > CACHED_PATTERNS:
+            patterns.popitem(last=False)
+    return regex
+
+# Newlines in mm[start:end], counted a block at a time.
+def count_newlines(mm, start, end):
+    count = 0
+    while start < end:
+        stop = min(end, start + BLOCK)
+        count += mm[start:stop].count(b'\n')
+        start = stop
+    return count
+
+def line_end(mm, start):
+    end = mm.find(b'\n', start)
+    return len(mm) if end == -1 else end
+
+# Yields (line, start, end) for every line with a match, where mm[start:end]
+# is the line without its newline. A line is only yielded once.
+def matching_lines(mm, regex):
+    line = 1
+    counted = 0
+    position = 0
+    while True:
+        m = regex.search(mm, position)
+        if m is None:
+            return
+        # An empty match past the last newline isn't a line.
+        if m.start() == len(mm) and (not mm or mm[-1:] == b'\n'):
+            return
+        i = mm.rfind(b'\n', position, m.start())
+        start = i + 1 if i != -1 else position
+        end = line_end(mm, m.start())
+        line += count_newlines(mm, counted, start)
+        counted = start
+        yield line, start, end
+        position = end + 1
+
+# [(start, end)] of up to count lines before the line starting at start.
+def lines_before(mm, start, count):
+    spans = []
+    end = start - 1
+    while len(spans) < count and end >= 0:
+        s = mm.rfind(b'\n', 0, end) + 1
+        spans.append((s, end))
+        end = s - 1
+    return spans[::-1]
+
+def format_line(name, line, sep, text):
+    text = text.decode("UTF-8", "replace")
+    if name is None:
+        return "{}{}{}".format(line, sep, text)
+    return "{}{}{}{}{}".format(name, sep, line, sep, text)
+
+# Like grep -n: matching lines are "file:line:text", context lines
+# "file-line-text" and "--" separates groups that aren't contiguous.
+def grep_mapped(mm, name, regex, context):
+    shown = 0
+    # Next line of the previous match's trailing context, and its start.
+    after = None
+    remaining = 0
+    for line, start, end in matching_lines(mm, regex):
+        while remaining and after[0] < line:
+            n, s = after
+            e = line_end(mm, s)
+            yield format_line(name, n, '-', mm[s:e])
+            shown = n
+            after = (n + 1, e + 1)
+            remaining -= 1
+
+        before = lines_before(mm, start, min(context, line - 1 - shown))
+        first = line - len(before)
+        if context and shown and first > shown + 1:
+            yield "--"
+        for i, (s, e) in enumerate(before):
+            yield format_line(name, first + i, '-', mm[s:e])
+        yield format_line(name, line, ':', mm[start:end])
+        shown = line
+        after = (line + 1, end + 1)
+        remaining = context
+
+    while remaining and after[1] < len(mm):
+        n, s = after
+        e = line_end(mm, s)
+        yield format_line(name, n, '-', mm[s:e])
+        after = (n + 1, e + 1)
+        remaining -= 1
+
+# Empty files can't be mapped, they yield nothing.
+def grep_file(path, name, regex, context):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if b'\0' in mm[:BINARY_SAMPLE]:
+                return
+            yield from grep_mapped(mm, name, regex, context)
+
+# Globs are expanded and directories searched recursively, skipping hidden
+# entries. Paths that don't exist raise right away.
+def expand(paths):
+    files = []
+    for path in paths:
+        found = sorted(glob.glob(path)) if glob.has_magic(path) else [path]
+        if not found:
+            raise FileNotFoundError(path)
+        for p in found:
+            os.stat(p)
+            files.append(p)
+    return files
+
+def walk_files(path):
+    if not os.path.isdir(path):
+        yield path
+        return
+    for directory, dirs, names in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for n in sorted(names):
+            if not n.startswith('.'):
+                yield os.path.join(directory, n)
+
+# Returns a generator of output lines. The pattern and the paths are checked
+# on the call, the files are searched as the lines are consumed. File names
+# are left out when a single file is searched.
+def grep(pattern, paths, context=0, ignore_case=False):
+    regex = compile(pattern, ignore_case)
+    files = expand(paths)
+    single = len(files) == 1 and not os.path.isdir(files[0])
+    return grep_files(files, regex, context, single)
+
+def grep_files(files, regex, context, single):
+    for path in files:
+        for f in walk_files(path):
+            try:
+                yield from grep_file(f, None if single else f, regex, context)
+            except OSError:
+                continue
+
+###
+# Substitutions. /sub shows the changed lines first and only edits the file
+# when the preview is applied. The preview is applied through the editor, after
+# checking that the lines still read as they did.
+###
+
+# line is the line number; old and new are its text before and after. new may
+# hold several lines if the replacement has newlines.
+Change = namedtuple("Change", ["line", "old", "new"])
+
+Preview = namedtuple("Preview", ["filename", "pattern", "replacement",
+    "changes"])
+
+# Kept across reloads (see reloader.py).
+try:
+    previews
+except NameError:
+    # previews = {user_id: Preview}
+    previews = {}
+
+# Replacements use the syntax of re.sub (\1, \g<name>).
+def substitute(pattern, replacement, filename, ignore_case=False):
+    regex = compile(pattern, ignore_case)
+    replacement_bytes = replacement.encode("UTF-8")
+    changes = []
+    with open(filename, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return Preview(filename, pattern, replacement, changes)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line, start, end in matching_lines(mm, regex):
+                old = mm[start:end]
+                new = regex.sub(replacement_bytes, old)
+                if new != old:
+                    changes.append(Change(line, old.decode("UTF-8"),
+                        new.decode("UTF-8")))
+    return Preview(filename, pattern, replacement, changes)
+
+# Returns the edited lines. Raises ValueError if the file changed since the
+# preview.
+def apply_to_buffer(lines, changes):
+    lines = list(lines)
+    for change in reversed(changes):
+        if change.line > len(lines) or lines[change.line - 1] != change.old:
+            raise ValueError("Line {} changed since the preview.".format(
+                change.line))
+        lines[change.line - 1:change.line] = change.new.split('\n')
+    return lines
+
+def apply(preview):
+    editor.edit(preview.filename,
+        lambda lines: apply_to_buffer(lines, preview.changes))
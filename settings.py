@@ -0,0 +1,83 @@
+###
+# Settings. Plain Python so they can be edited from the chat like everything
+# else. Modules read them at import time.
+###
+
+# Seconds the commit worker waits for more edits before committing them all
+# together. 0 commits every edit on its own (still off the handler thread).
+COMMIT_WINDOW = 2.0
+
+# The register journal is folded into rom.pickle by a background thread once it
+# holds this many records.
+JOURNAL_COMPACT_RECORDS = 1000
+
+# Runs handlers on an asyncio loop (see aio.py): different users in parallel,
+# each user's updates in order. Edits of one file are serialized by its lock
+# (see editor.py), so more workers only add parallelism between files.
+ASYNC_DISPATCH = False
+# Threads for handlers and sends in asyncio mode.
+ASYNC_WORKERS = 8
+
+# Long outputs are sent as several messages at once (False) or one page at a
+# time with a "Next" button (True). At once, at most OUTPUT_EAGER_PAGES pages
+# are sent; the last of them gets the "Next" button if there are more.
+OUTPUT_PAGES = False
+OUTPUT_EAGER_PAGES = 10
+
+# Seconds a directory listing is reused by /ls while the directory's mtime
+# doesn't change.
+LS_CACHE_TTL = 5.0
+
+# Supervisor (see supervisor.py). Seconds between heartbeats of the bot, and
+# how long the supervisor waits for one (or for the first start) before killing
+# it.
+HEARTBEAT = 5.0
+HEARTBEAT_TIMEOUT = 30.0
+READY_TIMEOUT = 60.0
+# Backoff between failed starts, doubling from the first value up to the second.
+BACKOFF = (1.0, 300.0)
+# Failed starts in a row after which the code is rolled back to the last commit
+# that started cleanly.
+ROLLBACK_AFTER = 3
+
+# Latency histograms (see stats.py) in Prometheus text format: written to this
+# file every STATS_EXPORT_INTERVAL seconds, and/or served over HTTP on this
+# local port. None disables them.
+STATS_EXPORT_FILE = None
+STATS_EXPORT_PORT = None
+STATS_EXPORT_INTERVAL = 15.0
+
+# Webhook mode (see webhook.py). With a public URL set, Telegram posts updates
+# to a local HTTP server instead of the bot polling for them. The server
+# listens on WEBHOOK_LISTEN (put a TLS proxy in front of it) and only accepts
+# requests carrying WEBHOOK_SECRET, or a random secret made at startup if it's
+# None. At most WEBHOOK_QUEUE updates wait for the dispatcher; past that
+# Telegram is told to retry later.
+WEBHOOK_URL = None
+WEBHOOK_LISTEN = ("127.0.0.1", 8443)
+WEBHOOK_SECRET = None
+WEBHOOK_QUEUE = 100
+
+# Released registers bigger than this many bytes are kept compressed in memory
+# (see blobs.py).
+BLOB_COMPRESS_THRESHOLD = 4096
+
+# Outgoing messages (see outbox.py). At most SEND_RATE messages a second in
+# total and SEND_CHAT_RATE to each chat, sent by SEND_WORKERS threads. A send
+# failing on a network error is tried SEND_ATTEMPTS times, waiting from the
+# first to the second value of SEND_BACKOFF, doubling, in between. Before a
+# restart queued messages get up to SEND_FLUSH_TIMEOUT seconds to go out.
+SEND_RATE = 30.0
+SEND_CHAT_RATE = 1.0
+SEND_WORKERS = 4
+SEND_ATTEMPTS = 5
+SEND_BACKOFF = (1.0, 60.0)
+SEND_FLUSH_TIMEOUT = 5.0
+
+# Memory for the lines of recently edited files (see editor.py).
+BUFFER_CACHE_BYTES = 64 << 20
+
+# Documents (see documents.py). Bots can download documents up to 20 MB and
+# send them up to 50 MB.
+DOCUMENT_DOWNLOAD_LIMIT = 20 << 20
+DOCUMENT_UPLOAD_LIMIT = 50 << 20
@@ -0,0 +1,19 @@
+import runpy
+import sys
+
+# The libraries are what takes long to import.
+import telegram
+import telegram.ext
+
+###
+# The standby that supervisor.py keeps waiting while the bot runs. Nothing of
+# the bot's own is loaded until the supervisor hands over by writing a line to
+# stdin; bot.py is compiled and run only then, so edits made to it meanwhile,
+# and rollbacks, are always what starts.
+###
+
+if __name__ == "__main__":
+    if not sys.stdin.readline():
+        # The supervisor went away.
+        sys.exit(0)
+    runpy.run_path("bot.py", run_name="__main__")
@@ -0,0 +1,164 @@
+from collections import deque
+from contextlib import contextmanager
+import functools
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import os
+import threading
+import time
+
+import acl
+import settings
+
+###
+# Latency instrumentation. Every handler on the dispatcher, every Telegram API
+# request and the slow calls inside the bot (git, file edits, the journal) are
+# timed under a name. Each name keeps its last WINDOW samples, from which /stats
+# shows p50, p95 and p99. The same numbers can be exported in Prometheus text
+# format (see settings.STATS_EXPORT_FILE and settings.STATS_EXPORT_PORT).
+###
+
+WINDOW = 1024
+QUANTILES = [0.5, 0.95, 0.99]
+
+class Histogram:
+    def __init__(self):
+        self.samples = deque(maxlen=WINDOW)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def quantiles(self):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return [0.0 for _ in QUANTILES]
+        return [ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+            for q in QUANTILES]
+
+histograms = {}
+# Values read when reporting, like queue depths. {name: function}
+gauges = {}
+lock = threading.Lock()
+
+def record(name, seconds):
+    with lock:
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram()
+        histogram.add(seconds)
+
+@contextmanager
+def timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+def gauge(name, function):
+    with lock:
+        gauges[name] = function
+
+# Decorator for the functions of a phase, e.g. @stats.timed("git").
+def timed(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+###
+# Hooks into python-telegram-bot.
+###
+
+# Times the callbacks of every handler on the dispatcher, named after their
+# command.
+def wrap_handlers(dispatcher):
+    for handlers in dispatcher.handlers.values():
+        for handler in handlers:
+            command = getattr(handler, "command", None)
+            if command:
+                name = "command /" + command[0]
+            else:
+                name = "handler " + handler.callback.__name__
+            handler.callback = timed(name)(handler.callback)
+
+###
+# Reports.
+###
+
+def snapshot():
+    with lock:
+        return sorted((name, h.count, h.total, h.quantiles())
+            for name, h in histograms.items())
+
+# Lines for /stats.
+def report():
+    lines = []
+    for name, count, _, quantiles in snapshot():
+        lines.append("{}: {} calls, p50 {:.1f} ms, p95 {:.1f} ms, p99 {:.1f} ms".format(
+            name, count, *[q * 1000 for q in quantiles]))
+    for name, function in sorted(gauges.items()):
+        lines.append("{}: {}".format(name, function()))
+    rejected = sum(acl.rejected.values())
+    if rejected:
+        lines.append("Rejected updates: {}".format(rejected))
+    return lines
+
+def escape(value):
+    return str(value).replace('\\', "\\\\").replace('"', '\\"')
+
+def prometheus():
+    lines = ["# TYPE bot_latency_seconds summary"]
+    for name, count, total, quantiles in snapshot():
+        label = 'name="{}"'.format(escape(name))
+        for q, value in zip(QUANTILES, quantiles):
+            lines.append('bot_latency_seconds{{{},quantile="{}"}} {}'.format(
+                label, q, value))
+        lines.append("bot_latency_seconds_sum{{{}}} {}".format(label, total))
+        lines.append("bot_latency_seconds_count{{{}}} {}".format(label, count))
+    lines.append("# TYPE bot_gauge gauge")
+    for name, function in sorted(gauges.items()):
+        lines.append('bot_gauge{{name="{}"}} {}'.format(escape(name),
+            function()))
+    lines.append("# TYPE bot_rejected_updates_total counter")
+    for (user_id, command), count in list(acl.rejected.items()):
+        lines.append('bot_rejected_updates_total{{user="{}",command="{}"}} {}'.format(
+            escape(user_id), escape(command), count))
+    return '\n'.join(lines) + '\n'
+
+def export_file():
+    while True:
+        time.sleep(settings.STATS_EXPORT_INTERVAL)
+        tmp = settings.STATS_EXPORT_FILE + ".tmp"
+        with open(tmp, 'w') as f:
+            f.write(prometheus())
+        os.replace(tmp, settings.STATS_EXPORT_FILE)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+# Called once by bot.py.
+def start_export():
+    if settings.STATS_EXPORT_FILE:
+        threading.Thread(target=export_file, name="stats-file",
+            daemon=True).start()
+    if settings.STATS_EXPORT_PORT:
+        server = HTTPServer(("127.0.0.1", settings.STATS_EXPORT_PORT),
+            MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="stats-http",
+            daemon=True).start()
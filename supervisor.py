@@ -0,0 +1,177 @@
+import json
+import logging
+import os
+import select
+import signal
+import subprocess as subproc
+import sys
+import time
+
+import settings
+
+###
+# Supervisor. Replaces the restart loop of init.sh: it runs bot.py, backs off
+# when it keeps failing, kills it when it stops sending heartbeats, and rolls
+# the code back to the last commit that started cleanly after
+# settings.ROLLBACK_AFTER failed starts.
+#
+# A standby (standby.py) is kept waiting with the libraries already imported.
+# When the running bot exits the standby takes over and only then runs bot.py,
+# so the bot's code is always the current one.
+#
+# The bot talks to the supervisor through a pipe, see heartbeat.py.
+###
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+METRICS = os.path.join(REPO, "supervisor_metrics")
+LAST_GOOD = os.path.join(REPO, "last_good")
+
+logger = logging.getLogger("supervisor")
+
+class Worker:
+    def __init__(self):
+        read, write = os.pipe()
+        env = dict(os.environ, SUPERVISOR_FD=str(write))
+        self.process = subproc.Popen([sys.executable, "standby.py"],
+            cwd=REPO, env=env, stdin=subproc.PIPE, pass_fds=[write])
+        os.close(write)
+        self.pipe = read
+        self.buffer = b""
+
+    # Returns False if the standby died while waiting.
+    def take_over(self):
+        try:
+            self.process.stdin.write(b"go\n")
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            return False
+        return True
+
+    # Returns the next message, or None on timeout or exit.
+    def receive(self, timeout):
+        deadline = time.monotonic() + timeout
+        while b'\n' not in self.buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            ready, _, _ = select.select([self.pipe], [], [], remaining)
+            if not ready:
+                return None
+            data = os.read(self.pipe, 4096)
+            if not data:
+                return None
+            self.buffer += data
+        line, _, self.buffer = self.buffer.partition(b'\n')
+        return line.decode()
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subproc.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        os.close(self.pipe)
+
+metrics = {
+    "restarts": 0,
+    "failed_starts": 0,
+    "rollbacks": 0,
+    "time_to_ready": None,
+    "ready_since": None,
+}
+
+def save_metrics():
+    with open(METRICS, 'w') as f:
+        json.dump(metrics, f)
+
+def head():
+    try:
+        return subproc.check_output(["git", "rev-parse", "HEAD"], cwd=REPO,
+            encoding="UTF-8").strip()
+    except (OSError, subproc.CalledProcessError):
+        return None
+
+def rollback():
+    # Imported here so that a broken history module can't stop the supervisor
+    # from starting.
+    import committer
+    import history
+    with open(LAST_GOOD, 'r') as f:
+        sha = f.read().strip()
+    if sha == head():
+        logger.error("Already at the last good commit %s.", sha[:7])
+        return
+    logger.warning("Rolling back to %s.", sha[:7])
+    history.revert(history.find(sha))
+    committer.flush()
+    metrics["rollbacks"] += 1
+
+# Runs a worker until it exits or stops beating. Returns True if it got ready.
+def run(worker):
+    started = time.monotonic()
+    commit = head()
+    if not worker.take_over():
+        return False
+
+    message = worker.receive(settings.READY_TIMEOUT)
+    if message != "ready":
+        return False
+    metrics["time_to_ready"] = time.monotonic() - started
+    metrics["ready_since"] = time.time()
+    save_metrics()
+    logger.info("Ready in %.3f s.", metrics["time_to_ready"])
+    if commit is not None:
+        with open(LAST_GOOD, 'w') as f:
+            f.write(commit + '\n')
+
+    while worker.receive(settings.HEARTBEAT_TIMEOUT) == "beat":
+        pass
+    return True
+
+def main():
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    failures = 0
+    standby = Worker()
+    while True:
+        worker = standby
+        # The next standby imports the libraries while this one runs.
+        standby = Worker()
+        try:
+            ready = run(worker)
+        except BaseException:
+            standby.stop()
+            raise
+        finally:
+            worker.stop()
+        metrics["restarts"] += 1
+        metrics["ready_since"] = None
+
+        if ready:
+            failures = 0
+        else:
+            failures += 1
+            metrics["failed_starts"] += 1
+            logger.error("Failed start %d in a row.", failures)
+            if failures % settings.ROLLBACK_AFTER == 0 and os.path.exists(LAST_GOOD):
+                try:
+                    rollback()
+                except Exception:
+                    logger.exception("Rollback failed.")
+            delay = min(settings.BACKOFF[0] * 2 ** (failures - 1),
+                settings.BACKOFF[1])
+            save_metrics()
+            logger.info("Restarting in %.0f s.", delay)
+            time.sleep(delay)
+            # The standby may have died meanwhile.
+            if standby.process.poll() is not None:
+                standby.stop()
+                standby = Worker()
+        save_metrics()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+from collections import OrderedDict
+import threading
+
+###
+# Syntax checks for edits of Python files (see editor.py), so that an edit
+# can't leave the bot unable to start. Compiling a large module takes a few
+# milliseconds per thousand lines, so the source is cut into its top-level
+# definitions and each piece is compiled on its own; an edit usually changes
+# one of them, and the others are found in the cache. The whole source is
+# only compiled when a piece fails, which also gives the right line number.
+###
+
+CACHED_CHUNKS = 4096
+# Lines starting one of these at column 0 start a new piece, unless they
+# follow a decorator.
+BOUNDARIES = ("def ", "class ", "async def ", "@")
+
+class SyntaxCheckError(ValueError):
+    pass
+
+# Kept across reloads (see reloader.py).
+try:
+    chunks
+except NameError:
+    # chunks = {source: compiles}
+    chunks = OrderedDict()
+    lock = threading.Lock()
+
+def is_python(filename):
+    return filename.endswith(".py")
+
+def split(lines):
+    pieces = []
+    start = 0
+    for i in range(1, len(lines)):
+        if (
+                lines[i].startswith(BOUNDARIES)
+                and not lines[i - 1].startswith('@')
+        ):
+            pieces.append('\n'.join(lines[start:i]) + '\n')
+            start = i
+    pieces.append('\n'.join(lines[start:]) + '\n')
+    return pieces
+
+def compiles(source):
+    with lock:
+        result = chunks.get(source)
+        if result is not None:
+            chunks.move_to_end(source)
+            return result
+    try:
+        compile(source, "<chunk>", "exec", dont_inherit=True)
+        result = True
+    except (SyntaxError, ValueError):
+        result = False
+    with lock:
+        chunks[source] = result
+        while len(chunks) > CACHED_CHUNKS:
+            chunks.popitem(last=False)
+    return result
+
+# Raises SyntaxCheckError, with the line of the error, if lines aren't valid
+# Python. Other files aren't checked.
+def check(filename, lines):
+    if not is_python(filename):
+        return
+    pieces = split(lines)
+    # A __future__ import only compiles on its own at the top of the module.
+    if (
+            all(compiles(p) for p in pieces)
+            and not any("__future__" in p for p in pieces[1:])
+    ):
+        return
+
+    try:
+        compile('\n'.join(lines) + '\n', filename, "exec", dont_inherit=True)
+    except SyntaxError as e:
+        raise SyntaxCheckError("{} in {}, line {}: {}".format(
+            type(e).__name__, filename, e.lineno, e.msg))
+    except ValueError as e:
+        raise SyntaxCheckError("{} doesn't compile: {}".format(filename, e))
@@ -0,0 +1,129 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import editor
+import transactions
+from transactions import Edit, TransactionError
+
+# Checks of how queued edits are applied on /commit (see transactions.py). Run
+# with: python -m unittest discover tests
+
+def edit(kind, line_start, line_end=None, text=None, old=None):
+    return Edit(kind, "f.txt", line_start,
+        line_start if line_end is None else line_end, text, kind, old)
+
+class ApplyToFileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "f.txt")
+        self.write(["1", "2", "3", "4", "5"])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, lines):
+        with open(self.path, 'w') as f:
+            f.write("".join(l + '\n' for l in lines))
+
+    def apply(self, *edits):
+        return transactions.apply_to_file(self.path, list(edits))[1]
+
+    def test_mixed_edits_use_the_original_line_numbers(self):
+        lines = self.apply(
+            edit("delete", 1),
+            edit("insert", 3, text="a\nb"),
+            edit("replace", 4, 5, "c"))
+        self.assertEqual(lines, ["2", "a", "b", "3", "c"])
+
+    def test_insertions_go_before_a_range_and_keep_their_order(self):
+        lines = self.apply(
+            edit("replace", 2, 3, "x"),
+            edit("insert", 2, text="a"),
+            edit("insert", 2, text="b"))
+        self.assertEqual(lines, ["1", "a", "b", "x", "4", "5"])
+
+    def test_overlapping_edits_fail(self):
+        with self.assertRaises(TransactionError):
+            self.apply(edit("replace", 2, 4, "x"), edit("delete", 3))
+        with self.assertRaises(TransactionError):
+            self.apply(edit("delete", 1, 2), edit("delete", 2, 3))
+
+    def test_adjacent_edits_dont_overlap(self):
+        lines = self.apply(edit("delete", 1, 2), edit("replace", 3, 3, "x"))
+        self.assertEqual(lines, ["x", "4", "5"])
+
+    def test_edits_past_the_end(self):
+        self.assertEqual(self.apply(edit("insert", 9, text="a")),
+            ["1", "2", "3", "4", "5", "a"])
+        self.assertEqual(self.apply(edit("replace", 5, 9, "x")),
+            ["1", "2", "3", "4", "x"])
+        self.assertEqual(self.apply(edit("replace", 7, 9, "x")),
+            ["1", "2", "3", "4", "5", "x"])
+        self.assertEqual(self.apply(edit("delete", 4, 9)), ["1", "2", "3"])
+
+    def test_invalid_line_fails(self):
+        with self.assertRaises(TransactionError):
+            self.apply(edit("insert", 0, text="a"))
+
+    def test_empty_text(self):
+        # A replace with nothing removes the lines, an insert adds none.
+        self.assertEqual(self.apply(edit("replace", 2, 3, "")),
+            ["1", "4", "5"])
+        self.assertEqual(self.apply(edit("insert", 2, text="")),
+            ["1", "2", "3", "4", "5"])
+        # A substitution with nothing leaves the line empty.
+        self.assertEqual(self.apply(edit("substitute", 2, text="", old="2")),
+            ["1", "", "3", "4", "5"])
+
+    def test_substitution_checks_the_line(self):
+        self.assertEqual(self.apply(edit("substitute", 3, text="a\nb",
+            old="3")), ["1", "2", "a", "b", "4", "5"])
+        with self.assertRaises(TransactionError):
+            self.apply(edit("substitute", 3, text="x", old="changed"))
+        with self.assertRaises(TransactionError):
+            self.apply(edit("substitute", 6, text="x", old="6"))
+
+    def test_new_file(self):
+        path = os.path.join(self.directory.name, "g.txt")
+        backup, lines = transactions.apply_to_file(path,
+            [edit("new", 1, text="a\nb"), edit("insert", 2, text="c")])
+        # The file has no original lines, so later edits go after its text.
+        self.assertIsNone(backup)
+        self.assertEqual(lines, ["a", "b", "c"])
+        with self.assertRaises(TransactionError):
+            transactions.apply_to_file(self.path, [edit("new", 1, text="a")])
+        with self.assertRaises(TransactionError):
+            transactions.apply_to_file(path,
+                [edit("insert", 1, text="a"), edit("new", 1, text="b")])
+
+class WriteAllTest(unittest.TestCase):
+    def test_failure_restores_the_files_written(self):
+        with tempfile.TemporaryDirectory() as directory:
+            old = os.path.join(directory, "old.txt")
+            new = os.path.join(directory, "new.txt")
+            broken = os.path.join(directory, "broken.txt")
+            with open(old, 'w') as f:
+                f.write("a\n")
+            buffers = {new: (None, ["n"]), old: (["a"], ["b"]),
+                broken: (["x"], ["y"])}
+
+            write_lines = editor.write_lines
+            def failing(path, lines, check=True):
+                if path == broken:
+                    raise OSError("disk full")
+                write_lines(path, lines, check)
+            with mock.patch.object(editor, "write_lines", failing):
+                with self.assertRaises(OSError):
+                    transactions.write_all(buffers)
+
+            self.assertFalse(os.path.exists(new))
+            with open(old, 'r') as f:
+                self.assertEqual(f.read(), "a\n")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+from collections import namedtuple, OrderedDict
+import os
+import threading
+
+import committer
+import editor
+import syntax
+
+###
+# Transactions. Between /begin and /commit the file commands of a user are
+# queued instead of applied. On /commit every edit is applied against the
+# line numbers the files had at /begin: each file is read once and written
+# once, and everything goes into a single commit. If anything fails, the files
+# already written are put back as they were.
+###
+
+# kind is "new", "insert", "replace", "delete" or "substitute". line_start and
+# line_end are the original line numbers; text is None for deletions. A
+# substitution (see search.py) replaces the single line line_start, which must
+# still be old, and its text is split on every newline, so an empty text
+# leaves an empty line.
+Edit = namedtuple("Edit",
+    ["kind", "filename", "line_start", "line_end", "text", "message", "old"],
+    defaults=[None])
+
+class TransactionError(Exception):
+    pass
+
+# Kept across reloads (see reloader.py).
+try:
+    transactions
+except NameError:
+    # transactions = {user_id: [Edit]}
+    transactions = {}
+    # The version each file had when its first edit was queued (see editor.py).
+    # versions = {user_id: {path: version}}
+    versions = {}
+    lock = threading.Lock()
+
+def begin(user_id):
+    with lock:
+        if user_id in transactions:
+            return False
+        transactions[user_id] = []
+        versions[user_id] = {}
+        return True
+
+def active(user_id):
+    return user_id in transactions
+
+def queue(user_id, edit):
+    path = os.path.abspath(edit.filename)
+    with lock:
+        transactions[user_id].append(edit)
+        if path not in versions[user_id]:
+            versions[user_id][path] = editor.version(path)
+
+def abort(user_id):
+    with lock:
+        versions.pop(user_id, None)
+        return transactions.pop(user_id, None)
+
+# Applies and commits the user's queued edits. Returns how many there were.
+# Files edited by someone else since their edits were queued make it fail, as
+# the queued line numbers may no longer point where they did.
+def commit(user_id):
+    with lock:
+        edits = transactions.pop(user_id)
+        seen = versions.pop(user_id)
+    if not edits:
+        return 0
+
+    # Edits grouped by file, in the order they were queued.
+    files = OrderedDict()
+    for edit in edits:
+        files.setdefault(os.path.abspath(edit.filename), []).append(edit)
+
+    with editor.locked(files.keys()):
+        try:
+            for path in files.keys():
+                editor.check_version(path, seen[path])
+        except editor.StaleFile as e:
+            raise TransactionError(str(e))
+
+        # Everything is computed and checked before anything is written.
+        buffers = OrderedDict()
+        for path, file_edits in files.items():
+            buffers[path] = apply_to_file(path, file_edits)
+        try:
+            for path, (_, lines) in buffers.items():
+                editor.check_syntax(path, lines)
+        except syntax.SyntaxCheckError as e:
+            raise TransactionError(str(e))
+
+        write_all(buffers)
+    committer.queue_commit(committer.join_messages([e.message for e in edits]),
+        list(buffers.keys()))
+    return len(edits)
+
+# Turns an edit into the slice [start:end] of the original lines it replaces,
+# and the lines that replace it.
+def as_range(edit, original):
+    length = len(original)
+    if edit.line_start < 1:
+        raise TransactionError("Invalid line {}.".format(edit.line_start))
+    if edit.kind == "substitute":
+        start = edit.line_start - 1
+        if start >= length or original[start] != edit.old:
+            raise TransactionError("Line {} of {} changed since the preview."
+                .format(edit.line_start, edit.filename))
+        return start, start + 1, edit.text.split('\n')
+    start = min(edit.line_start - 1, length)
+    if edit.kind in ["insert", "new"]:
+        end = start
+    else:
+        end = min(max(edit.line_start, edit.line_end), length)
+    text = editor.split_lines(edit.text) if edit.text is not None else []
+    return start, end, text
+
+# Returns the original lines (None for a new file) and the edited ones.
+def apply_to_file(path, edits):
+    new = [e for e in edits if e.kind == "new"]
+    if new:
+        if len(new) > 1 or edits[0].kind != "new" or os.path.exists(path):
+            raise TransactionError("Can't create {}.".format(edits[0].filename))
+        backup = None
+        original = []
+    else:
+        backup = original = editor.read_lines(path)
+
+    ranges = [as_range(e, original) + (i,) for i, e in enumerate(edits)]
+    # Insertions at a position go before a range starting there, and keep
+    # their order among themselves.
+    ranges.sort(key=lambda r: (r[0], r[1] > r[0], r[3]))
+
+    lines = []
+    position = 0
+    for start, end, text, i in ranges:
+        if start < position:
+            raise TransactionError("Edits overlap in {}: {}".format(
+                edits[i].filename, edits[i].message))
+        lines += original[position:start]
+        lines += text
+        position = max(position, end)
+    lines += original[position:]
+    return backup, lines
+
+# Writes every buffer, or none: on failure the files written so far are
+# restored from their original lines.
+def write_all(buffers):
+    written = []
+    try:
+        for path, (backup, lines) in buffers.items():
+            editor.write_lines(path, lines)
+            written.append((path, backup))
+    except:
+        for path, backup in reversed(written):
+            if backup is None:
+                os.remove(path)
+            else:
+                editor.write_lines(path, backup, check=False)
+        raise
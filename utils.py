@@ -1,27 +1,24 @@
+import committer
+import logging
 import os
 import pickle
-import subprocess as subproc
+import stats
 from time import sleep
 
 # Update and Context objects are provided by the python-telegram-bot updater.
 
-# It's kind of ugly how I call this function before and after each write. But
-# it's the simpliest way I could think of for ensuring proper formatting.
-def ensure_trailing_newline(filename):
-    subproc.run(["sed", "-i", "-e", "$ a \\", filename], check=True)
-
-def count_lines_in_file(filename):
-    try:
-        wc = subproc.check_output(["wc", "-l", filename], encoding="UTF-8")
-        lines = wc.split(' ')[0]
-        lines = int(lines)
-        return lines
-    except:
-        return -1
+ROM = "rom.pickle"
 
+# Only used to snapshot the rom, mutations go to the journal (see journal.py).
+# The snapshot replaces rom.pickle atomically, so a crash leaves the old one.
+@stats.timed("save_rom")
 def save_rom(rom):
-    with open("rom.pickle", "wb") as f:
+    tmp = ROM + ".tmp"
+    with open(tmp, "wb") as f:
         pickle.dump(rom, f, pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, ROM)
 
 # Some commands require the no register to be active.
 def must_release_rom(rom, update, context):
@@ -57,13 +54,17 @@ def create_registry_if_inexistent(rom, update):
         rom[update.effective_user.id] = [None, {}]
     return rom
 
-def git_commit(message):
-    command = ["git", "add", "-A"]
-    subproc.run(command, check=True)
-    command = ["git", "commit", "-m", message]
-    subproc.run(command, check=True)
+# The commit is made later by the commit worker, together with any other edit
+# that arrives shortly after.
+def git_commit(message, paths):
+    committer.queue_commit(message, paths)
 
 # This is ugly, but it prevents the process from perpetually shutting down.
 def stop_process():
+    # Queued edits must be committed before the process goes away.
+    try:
+        committer.flush()
+    except:
+        logging.exception("Couldn't commit queued edits.")
     sleep(1)
     os.kill(os.getpid(), 15)
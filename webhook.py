@@ -0,0 +1,111 @@
+import hmac
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import queue
+import secrets
+import threading
+import time
+
+from telegram import Update
+
+import settings
+import stats
+
+###
+# Webhook mode. Telegram posts every update to a local HTTP server, which checks
+# the secret token and puts the update on a bounded queue. A single thread
+# feeds the queue to the dispatcher, so updates are handled in the order they
+# arrived, like with polling. When the queue is full the server answers 503
+# and Telegram sends the update again later.
+###
+
+# Telegram's updates are much smaller than this.
+MAX_BODY = 1 << 20
+
+logger = logging.getLogger(__name__)
+
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, dispatcher, secret, size):
+        super().__init__(address, WebhookHandler)
+        self.dispatcher = dispatcher
+        self.secret = secret
+        self.updates = queue.Queue(size)
+        self.received = 0
+        self.rejected = 0
+
+    def pump(self):
+        while True:
+            queued, update = self.updates.get()
+            stats.record("webhook queue", time.perf_counter() - queued)
+            try:
+                self.dispatcher.process_update(update)
+            except Exception:
+                logger.exception("Update failed.")
+
+    def healthy(self):
+        return all(t.is_alive() for t in self.threads)
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        token = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        # The body isn't read on these, so the connection can't be reused.
+        if not hmac.compare_digest(token, server.secret):
+            self.close_connection = True
+            self.answer(403)
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        if length > MAX_BODY:
+            self.close_connection = True
+            self.answer(413)
+            return
+        try:
+            data = json.loads(self.rfile.read(length))
+            update = Update.de_json(data, server.dispatcher.bot)
+        except ValueError:
+            self.answer(400)
+            return
+
+        try:
+            server.updates.put_nowait((time.perf_counter(), update))
+        except queue.Full:
+            server.rejected += 1
+            self.answer(503, {"Retry-After": "1"})
+            return
+        server.received += 1
+        self.answer(200)
+
+    def answer(self, status, headers={}):
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+# Starts the server and the dispatcher feed. The webhook is registered with
+# Telegram only if url is given. Without a configured secret a random one is
+# made for this run, so that requests without it are always refused.
+def start(dispatcher, url=None, address=None, secret=None, size=None):
+    secret = secret or settings.WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    server = WebhookServer(address or settings.WEBHOOK_LISTEN, dispatcher,
+        secret, size or settings.WEBHOOK_QUEUE)
+    server.threads = [
+        threading.Thread(target=server.pump, name="webhook-pump", daemon=True),
+        threading.Thread(target=server.serve_forever, name="webhook"),
+    ]
+    for thread in server.threads:
+        thread.start()
+
+    if url:
+        dispatcher.bot.set_webhook(url=url,
+            api_kwargs={"secret_token": server.secret})
+    return server